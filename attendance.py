@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+def _bit_count(bits):
+    return bin(bits).count('1')
+
+class Absences:
+    """Absences of a member in the meetings of an AttendanceMatrix."""
+
+    def __init__(self, member, absentCount, absentStreak, attendanceRate):
+        self.member = member
+        self.absentCount = absentCount
+        self.absentStreak = absentStreak # Absent in this many of the latest meetings in a row
+        self.attendanceRate = attendanceRate # Share of meetings present (0..1)
+
+    @property
+    def personId(self):
+        return self.member.personId
+
+    @property
+    def firstName(self):
+        return self.member.firstName
+
+    @property
+    def lastName(self):
+        return self.member.lastName
+
+    def __lt__(self, other):
+        return self.member < other.member
+
+    def __str__(self):
+        return str(self.member)
+
+class AttendanceMatrix:
+    """Which member was present in which meeting.
+
+    Built from the get_meeting_members() results of a series of meetings, latest meeting first
+    (an empty list for a meeting which didn't take place). For each person, the meetings are
+    kept as bits of an int (bit 0 = latest meeting), so counting over a window of meetings
+    is a single mask and bit count, no matter how many meetings there are.
+    """
+
+    def __init__(self, meeting_members):
+        self.num_meetings = len(meeting_members)
+        self.members = {} # by personId, as listed in their latest meeting
+        self._listed = {} # personId -> bits of the meetings the person was listed in
+        self._absent = {} # personId -> bits of the meetings the person was absent in
+        for n, members in enumerate(meeting_members):
+            bit = 1 << n
+            for member in members:
+                self.members.setdefault(member.personId, member)
+                self._listed[member.personId] = self._listed.get(member.personId, 0) | bit
+                if not member.present:
+                    self._absent[member.personId] = self._absent.get(member.personId, 0) | bit
+
+    def _window(self, meetings):
+        """Bit mask for the latest given number of meetings (all meetings if None)."""
+        if meetings is None:
+            meetings = self.num_meetings
+        return (1 << meetings) - 1
+
+    def absent_count(self, person_id, meetings=None):
+        return _bit_count(self._absent.get(person_id, 0) & self._window(meetings))
+
+    def absent_streak(self, person_id):
+        """In how many of the latest meetings in a row the person was absent."""
+        absent = self._absent.get(person_id, 0)
+        # Number of trailing 1 bits
+        return (~absent & (absent + 1)).bit_length() - 1
+
+    def attendance_rate(self, person_id, meetings=None):
+        window = self._window(meetings)
+        listed = _bit_count(self._listed.get(person_id, 0) & window)
+        if not listed:
+            return 0.0
+        return 1 - _bit_count(self._absent.get(person_id, 0) & window) / listed
+
+    def absences(self, person_id, meetings=None):
+        return Absences(self.members[person_id],
+                        self.absent_count(person_id, meetings),
+                        self.absent_streak(person_id),
+                        self.attendance_rate(person_id, meetings))
+
+    def absent_at_least(self, threshold, meetings=None):
+        """Absences of the members absent at least threshold times in the latest meetings, sorted by name."""
+        window = self._window(meetings)
+        return sorted(self.absences(person_id, meetings) for person_id, absent in self._absent.items()
+                      if _bit_count(absent & window) >= threshold)
+
+    def absent_in_a_row(self, count):
+        """Members absent in each of the latest count meetings, sorted by name."""
+        if count > self.num_meetings:
+            return []
+        window = self._window(count)
+        return sorted(self.members[person_id] for person_id, absent in self._absent.items()
+                      if absent & window == window)
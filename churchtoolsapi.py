@@ -6,236 +6,545 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import atexit
+import bisect
+import calendar
+import copy
 import datetime
-import io
-import pickle
+import functools
+import json
+import logging
 import os
-import requests
-
-from dotenv import load_dotenv
-from os.path import exists
-from PIL import Image, ImageDraw, ImageFilter
-from pyactiveresource.activeresource import ActiveResource
-
-# DEBUG MODE (cache REST API result)
-DEBUG = False
-CACHED_FILENAME = "persons_{group_id}.dump"
+import re
+import shutil
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import churchtoolscache
+import churchtoolshttp
+import churchtoolsimages
+import churchtoolsprofile
+import households
+
+from concurrent.futures import ThreadPoolExecutor
+from model import Child, Member, Person, str_to_date
 
 # Random limits from Churchtools API
 MAX_PERSONS_LIMIT = 500
 MAX_GROUP_MEMBERS_LIMIT = 100
-
-load_dotenv()
-
-# REST API definitions
-class ApiBase(ActiveResource):
-    _site = 'https://' + os.getenv('CHURCHTOOLS_DOMAIN') + '/api/'
-    _headers = { 'Authorization': 'Login ' + os.getenv('CHURCHTOOLS_LOGIN_TOKEN') }
-
-class Group(ApiBase):
-    pass
-
-class Person(ApiBase):
-    pass
-
-class Child:
-    def __lt__(self, other):
-        return self.birthdate > other.birthdate
-
-    def __str__(self):
-        return self.name + self.age
-
-def str_to_date(birthdate_str):
-    if not birthdate_str:
-        return datetime.date(1900, 1, 1)
-    return datetime.datetime.strptime(birthdate_str, "%Y-%m-%d").date()
-
-def __age(birthdate_str):
-    if not birthdate_str:
-        return ""
-    birthdate = str_to_date(birthdate_str)
-    today = datetime.date.today()
-    age = today.year - birthdate.year - ((today.month, today.day) < (birthdate.month, birthdate.day))
-    return age
-
-def format_date(birthdate_str):
-    if not birthdate_str:
-        return ""
-    birthdate = str_to_date(birthdate_str)
-    return birthdate.strftime("%d.%m.%Y")
-
-# From https://note.nkmk.me/en/python-pillow-square-circle-thumbnail/
-def __mask_circle_transparent(pil_img, blur_radius, offset=0):
-    offset = blur_radius * 2 + offset
-    mask = Image.new("L", pil_img.size, 0)
-    draw = ImageDraw.Draw(mask)
-    draw.ellipse((offset, offset, pil_img.size[0] - offset, pil_img.size[1] - offset), fill=255)
-    mask = mask.filter(ImageFilter.GaussianBlur(blur_radius))
-
-    result = pil_img.copy()
-    result.putalpha(mask)
-
-    return result
-
-def __make_img_round(img_bytes):
-    im = Image.open(io.BytesIO(img_bytes))
-    im_round = __mask_circle_transparent(im, 0, 2)
-    img_byte_arr = io.BytesIO()
-    im_round.save(img_byte_arr, format='PNG')
-    return img_byte_arr.getvalue()
-
-
-def get_persons(filter_group_id=None, filter_role_id=None, include_images=False):
-    filter_group_id = int(filter_group_id) if filter_group_id else None
-    filter_role_id = int(filter_role_id) if filter_role_id else None
-    filename = CACHED_FILENAME.format(group_id=filter_group_id)
-    if DEBUG and exists(filename):
-        with open(filename, 'rb') as f:
-            return pickle.load(f)
-
-    # Get all persons
-    persons_result = Person.find(from_=ApiBase._site + 'persons', limit=MAX_PERSONS_LIMIT)
-    persons = persons_result[0]['data']
-
-    # Filter only those in current group
-    if filter_group_id:
-        persons_filtered = []
-        group_url = ApiBase._site + 'groups/{id}/members'.format(id=filter_group_id)
-        persons_in_group_result = Group.find(from_=group_url, limit=MAX_GROUP_MEMBERS_LIMIT)
-        persons_in_group = persons_in_group_result[0]['data']
-        # Remove persons not in this group from persons
-        for person in persons:
-            found = False
-            for group_person in persons_in_group:
-                if group_person['personId'] == person['id']:
-                    found = True
-
-                if filter_role_id:
-                    found = found and group_person['groupTypeRoleId'] == filter_role_id
-
-                if found:
-                    break
-            if found:
-                persons_filtered.append(person)
-        persons = persons_filtered
-
-    # Postprocessing
+MAX_MEETINGS_LIMIT = 100
+
+# Number of items requested per page (capped by the limits above)
+page_size = None
+
+# Number of API requests running in parallel (1 = sequential)
+max_concurrency = 4
+
+# churchtoolscache.ResponseCache for API responses (None = no caching)
+cache = None
+
+# churchtoolscache.Snapshot of relationships from earlier runs (None = always fetch all)
+snapshot = None
+
+# Directory to keep downloaded and round profile images in (None = no caching)
+image_cache_dir = None
+
+# churchtoolscache.Journal of the progress of this run (None = no checkpointing).
+# With it, failures of single persons (e.g. a broken image) don't abort the run.
+journal = None
+
+# What failed for single persons with checkpointing (descriptions, for the report at the end)
+failures = []
+
+# Client for the API (None = from the environment on first use)
+client = None
+
+logger = logging.getLogger(__name__)
+
+class Client:
+    """The ChurchTools instance to use, and how to log in."""
+
+    def __init__(self, domain, login_token):
+        # The domain may also be a URL, e.g. http://127.0.0.1:8765 for mockchurchtools.py
+        if not re.match('https?://', domain):
+            domain = 'https://' + domain
+        self.site = domain.rstrip('/') + '/api/'
+        self.headers = {'Authorization': 'Login ' + login_token}
+
+    @classmethod
+    def from_env(cls):
+        """Client for CHURCHTOOLS_DOMAIN and CHURCHTOOLS_LOGIN_TOKEN (from the environment or .env)."""
+        from dotenv import load_dotenv
+        load_dotenv()
+        domain = os.getenv('CHURCHTOOLS_DOMAIN')
+        login_token = os.getenv('CHURCHTOOLS_LOGIN_TOKEN')
+        if not domain or not login_token:
+            raise ValueError("CHURCHTOOLS_DOMAIN and CHURCHTOOLS_LOGIN_TOKEN must be set (see .env.sample)")
+        return cls(domain, login_token)
+
+def get_client():
+    global client
+    if client is None:
+        client = Client.from_env()
+    return client
+
+def _api_url(path):
+    return get_client().site + path
+
+def add_arguments(parser):
+    parser.add_argument("--page-size", type=int, help="Number of items to fetch per API request")
+    parser.add_argument("--max-concurrency", type=int, default=max_concurrency,
+                        help="Number of API requests to run in parallel (1 disables parallel requests)")
+    parser.add_argument("--max-retries", type=int, default=churchtoolshttp.max_retries,
+                        help="How often to retry rate limited or failed API requests")
+    parser.add_argument("--cache", nargs="?", const=churchtoolscache.DEFAULT_CACHE_FILENAME, metavar="FILE",
+                        help="Cache API responses in this file (default: {})".format(churchtoolscache.DEFAULT_CACHE_FILENAME))
+    parser.add_argument("--cache-max-size", type=int, default=churchtoolscache.DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help="Maximum size of the cache file in MB")
+    parser.add_argument("--incremental", nargs="?", const=churchtoolscache.DEFAULT_SNAPSHOT_FILENAME, metavar="FILE",
+                        help="Only fetch relationships of persons changed since the last run, "
+                             "keep the others in this file (default: {})".format(churchtoolscache.DEFAULT_SNAPSHOT_FILENAME))
+    parser.add_argument("--image-cache", nargs="?", const=churchtoolsimages.DEFAULT_IMAGE_CACHE_DIR, metavar="DIR",
+                        help="Keep downloaded and processed profile images in this directory "
+                             "(default: {})".format(churchtoolsimages.DEFAULT_IMAGE_CACHE_DIR))
+    parser.add_argument("--checkpoint", nargs="?", const=churchtoolscache.DEFAULT_JOURNAL_FILENAME, metavar="FILE",
+                        help="Keep the progress in this file, so an aborted run can be resumed by running it again. "
+                             "Failures of single persons are logged and skipped "
+                             "(default: {})".format(churchtoolscache.DEFAULT_JOURNAL_FILENAME))
+    parser.add_argument("--verbose", action="store_true", help="Log progress (e.g. timing of API requests)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print how long each phase took, the API requests and cache hit rates at the end")
+    parser.add_argument("--profile-out", metavar="FILE", help="Write the --profile measurements to this file (JSON)")
+    parser.add_argument("--profile-render", metavar="FILE",
+                        help="Write cProfile stats of rendering the documents to this file (one per document)")
+
+def configure(args):
+    global page_size, max_concurrency, cache, snapshot, image_cache_dir, journal
+    page_size = args.page_size
+    max_concurrency = max(1, args.max_concurrency)
+    churchtoolshttp.pool_size = max_concurrency
+    churchtoolshttp.max_retries = args.max_retries
+    if args.cache:
+        cache = churchtoolscache.ResponseCache(args.cache, args.cache_max_size * 1024 * 1024)
+    if args.incremental:
+        snapshot = churchtoolscache.Snapshot(args.incremental)
+    image_cache_dir = args.image_cache
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(name)s: %(message)s")
+    if args.checkpoint:
+        journal = churchtoolscache.Journal(args.checkpoint)
+        if journal.count():
+            logger.warning("Resuming from %s (%d entries)", args.checkpoint, journal.count())
+        # The images are kept with the journal, unless they are cached anyway
+        image_cache_dir = image_cache_dir or _checkpoint_image_dir()
+    try:
+        get_client()
+    except ValueError as e:
+        sys.exit(str(e))
+    if journal:
+        atexit.register(_report_unfinished)
+    churchtoolsprofile.enabled = bool(args.profile or args.profile_out)
+    churchtoolsprofile.render_profile = args.profile_render
+    if churchtoolsprofile.enabled:
+        atexit.register(_report_profile, args.profile, args.profile_out)
+
+def _checkpoint_image_dir():
+    return journal.filename + '-images'
+
+def finish_run():
+    """Mark the run as complete. Called by the scripts at the end, after all output was written.
+
+    With --checkpoint, this removes the journal. Without the call (e.g. after an error or a wrong argument),
+    the journal is kept, so the next run resumes from it.
+    """
+    global journal
+    if not journal:
+        return
+    if failures:
+        # Not kept for them, as it would keep the next runs from seeing changes of the other persons
+        logger.warning("%d failures were replaced by placeholders, they are tried again in the next run", len(failures))
+    journal.remove()
+    shutil.rmtree(_checkpoint_image_dir(), ignore_errors=True)
+    journal = None
+
+def _report_unfinished():
+    if journal:
+        logger.warning("Run not completed, run again with --checkpoint %s to resume", journal.filename)
+
+def _failed(what, error):
+    """With checkpointing, log the failure and go on with a placeholder. Without, abort."""
+    if not journal:
+        raise error
+    logger.warning("%s failed, using a placeholder: %s", what, error)
+    failures.append(what)
+
+def _report_profile(print_summary, filename):
+    if cache:
+        churchtoolsprofile.count('response cache: hits', cache.hits)
+        churchtoolsprofile.count('response cache: revalidated', cache.revalidated)
+        churchtoolsprofile.count('response cache: misses', cache.misses)
+    if snapshot:
+        churchtoolsprofile.count('relationship snapshot: hits', snapshot.reused)
+        churchtoolsprofile.count('relationship snapshot: misses', snapshot.updated)
+    if print_summary:
+        print(churchtoolsprofile.summary(), file=sys.stderr)
+    if filename:
+        churchtoolsprofile.write_trace(filename)
+
+def _get(url, **params):
+    """GET an API URL and return the decoded JSON response. Goes through the response cache if enabled."""
+    if params:
+        url += '?' + urllib.parse.urlencode(params)
+    entry = cache.get(url) if cache else None
+    if entry and entry.is_fresh(churchtoolscache.ttl_for(url)):
+        cache.hits += 1
+        return json.loads(entry.body)
+
+    headers = dict(get_client().headers)
+    if entry and entry.etag:
+        headers['If-None-Match'] = entry.etag
+    if entry and entry.last_modified:
+        headers['If-Modified-Since'] = entry.last_modified
+    response = churchtoolshttp.get(url, headers)
+    if entry and response.status_code == 304:
+        cache.revalidated += 1
+        cache.touch(url)
+        return json.loads(entry.body)
+
+    if cache:
+        cache.misses += 1
+        cache.put(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return response.json()
+
+def _paginate(url, max_limit, **params):
+    """Yield the items of a paginated API list, one page at a time."""
+    limit = min(page_size, max_limit) if page_size else max_limit
+    page = 1
+    while True:
+        start = time.perf_counter()
+        result = _get(url, page=page, limit=limit, **params)
+        items = result['data']
+        last_page = result.get('meta', {}).get('pagination', {}).get('lastPage') or page
+        logger.info("%s: page %d/%d (%d items) in %.2fs",
+                    url, page, last_page, len(items), time.perf_counter() - start)
+        yield from items
+        if not items or page >= last_page:
+            break
+        page += 1
+
+def _map_concurrent(func, items):
+    """Like map(), but runs up to max_concurrency calls in parallel. Keeps the order of items."""
+    if max_concurrency <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        return list(executor.map(func, items))
+
+def iter_persons():
+    return _paginate(_api_url('persons'), MAX_PERSONS_LIMIT)
+
+def iter_group_members(group_id):
+    group_url = _api_url('groups/{id}/members'.format(id=group_id))
+    return _paginate(group_url, MAX_GROUP_MEMBERS_LIMIT)
+
+def _to_ids(ids):
+    """Normalize a single ID or a list of IDs (int or str) to a set of ints."""
+    if not ids:
+        return set()
+    if isinstance(ids, (int, str)):
+        ids = [ids]
+    return {int(id_) for id_ in ids if id_}
+
+@functools.lru_cache(maxsize=None)
+def _get_group_membership(group_id):
+    """Members of one group (personId -> role IDs), fetched once per run."""
+    membership = {}
+    for group_person in iter_group_members(group_id):
+        membership.setdefault(group_person['personId'], set()).add(group_person['groupTypeRoleId'])
+    return membership
+
+def get_group_memberships(group_ids):
+    """Map the ID of each person in the given groups to the IDs of their roles in these groups."""
+    memberships = {}
+    for group_id in sorted(_to_ids(group_ids)):
+        for person_id, role_ids in _get_group_membership(group_id).items():
+            memberships.setdefault(person_id, set()).update(role_ids)
+    return memberships
+
+def filter_persons(persons, filter_group_id=None, filter_role_id=None):
+    """Only the persons in the given group(s), with the given role(s) if any. Keeps the order of persons."""
+    filter_group_ids = _to_ids(filter_group_id)
+    filter_role_ids = _to_ids(filter_role_id)
+    if not filter_group_ids:
+        return list(persons)
+    memberships = get_group_memberships(filter_group_ids)
+    return [person for person in persons
+            if person.id in memberships
+            and (not filter_role_ids or memberships[person.id] & filter_role_ids)]
+
+@functools.lru_cache(maxsize=None)
+def _get_all_persons():
+    """All persons, downloaded once per run and shared by all get_persons() calls."""
+    return tuple(Person.from_api(person) for person in iter_persons())
+
+@functools.lru_cache(maxsize=None)
+def _fetch_person(api_url):
+    data = journal.get('person', api_url) if journal else None
+    if data is None:
+        data = _get(api_url)['data']
+        if journal:
+            journal.put('person', api_url, data)
+    return Person.from_api(data)
+
+def __get_relative(relative, persons_by_id):
+    """Look up a relative in the already fetched persons, only fetch it if it is not there."""
+    relative_person = persons_by_id.get(int(relative['domainIdentifier']))
+    if relative_person:
+        return relative_person
+    try:
+        return _fetch_person(relative['apiUrl'])
+    except Exception as e:
+        _failed("Relative {}".format(relative['domainIdentifier']), e)
+        return None
+
+def _get_relationships(person):
+    modified = person.modified
+    if snapshot:
+        relationships = snapshot.get_relationships(person.id, modified)
+        if relationships is not None:
+            return relationships
+    if journal:
+        relationships = journal.get('relationships', person.id)
+        if relationships is not None:
+            return relationships
+
+    relationships_url = _api_url('persons/{id}/relationships'.format(id=person.id))
+    try:
+        relationships = _get(relationships_url)['data']
+    except Exception as e:
+        # Not stored, so they are fetched again when resuming
+        _failed("Relationships of person {}".format(person.id), e)
+        return []
+    if snapshot:
+        snapshot.put_relationships(person.id, modified, relationships)
+    if journal:
+        journal.put('relationships', person.id, relationships)
+    return relationships
+
+def _spouse_ids(relationships):
+    return [int(r['relative']['domainIdentifier']) for r in relationships if r['relationshipTypeId'] == 2] # Ehepartner
+
+def _child_relatives(relationships):
+    return [r['relative'] for r in relationships
+            if r['relationshipTypeId'] == 1 and r['degreeOfRelationship'] == 'relationship.part.child'] # Kind
+
+def _address(person):
+    if not person.street:
+        return None
+    return (person.street.strip().lower(), person.zip)
+
+def _get_household_relationships(persons):
+    """Spouse IDs and child relatives of the persons (by ID).
+
+    The relationships of each person are fetched, as spouses don't necessarily have the same
+    children (e.g. after remarriage).
+    """
+    spouse_ids = {}
+    child_relatives = {}
+    for person, relationships in zip(persons, _map_concurrent(_get_relationships, persons)):
+        spouse_ids[person.id] = _spouse_ids(relationships)
+        child_relatives[person.id] = _child_relatives(relationships)
+    return spouse_ids, child_relatives
+
+def _get_households(persons, spouse_ids, child_relatives):
+    listed = {person.id: person for person in persons}
+    household_index = households.Households(listed)
     for person in persons:
-        # Profile pic
-        if include_images:
-            if person['imageUrl']:
-                person['image'] = requests.get(person['imageUrl']).content
-            else:
-                default_img_path = os.path.realpath(os.path.dirname(__file__)) + '/images/placeholder.png'
-                img = open(default_img_path,'rb')
-                person['image'] = bytes(img.read())
-
-            # Make image round
-            person['image'] = __make_img_round(person['image'])
-
-        # Format birthdate
-        if person['birthday']:
-            person['birthday_date'] = str_to_date(person['birthday'])
-            person['birthday'] = format_date(person['birthday'])
-        else:
-            person['birthday_date'] = None
-
-        # Relationships (Spouse, children)
-        relationships_url = ApiBase._site + 'persons/{id}/relationships'.format(id=person['id'])
-        relationships_result = Person.find(from_=relationships_url, limit=MAX_PERSONS_LIMIT)
-        relationships = relationships_result[0]['data']
-        person['children'] = []
-        person['family_id'] = "{}-{}".format(person['lastName'], person['firstName'])
-        person['familyEnd'] = False
-        personHasSpouse = False
-        if not relationships:
-            person['familyEnd'] = True
-        for relationship in relationships:
-            if relationship['relationshipTypeId'] == 1 and relationship['degreeOfRelationship'] == 'relationship.part.child': # Kind
-                child = Child()
-                child.name = relationship['relative']['domainAttributes']['firstName']
-                child_result = Person.find(from_=relationship['relative']['apiUrl'], limit=MAX_PERSONS_LIMIT)
-                if len(child_result) > 0:
-                    child.birthdate = str_to_date(child_result[0]['birthday'])
-                    child.age = ' (' + str(__age(child_result[0]['birthday'])) + ')'
-
-                person['children'].append(child)
-            elif relationship['relationshipTypeId'] == 2: # Ehepartner
-                personHasSpouse = True
-                # Create family_id for sorting (last name, ID of husband & wife)
-                if person['sexId'] == 1: # Male
-                    person['family_id'] = '{lastname}-{husband_name}-{wife_name}'.format(
-                                            lastname=person['lastName'],
-                                            husband_name=person['firstName'],
-                                            wife_name=str(relationship['relative']['domainAttributes']['firstName']))
-                else: # Female
-                    person['family_id'] = '{lastname}-{husband_name}-{wife_name}'.format(
-                                            lastname=person['lastName'],
-                                            husband_name=str(relationship['relative']['domainAttributes']['firstName']),
-                                            wife_name=person['firstName'])
-                    person['familyEnd'] = True
-
-        if not personHasSpouse:
-            person['familyEnd'] = True
-
-        # Sort children by age
-        person['children'].sort(reverse=True)
-
-        # All children in one line
-        person['allChildren'] = ', '.join(str(child) for child in person['children'])
+        for spouse_id in spouse_ids[person.id]:
+            if spouse_id in listed:
+                household_index.add_spouse(person.id, spouse_id)
+    for person in persons:
+        for relative in child_relatives[person.id]:
+            child = listed.get(int(relative['domainIdentifier']))
+            # Children are in the household of their parents as long as they live with them and aren't married
+            if child and not spouse_ids[child.id] and _address(child) and _address(child) == _address(person):
+                household_index.add_child(person.id, child.id)
+    return household_index
+
+def __add_children(person, child_relatives, persons_by_id):
+    person.children = []
+    for relative in child_relatives:
+        child_person = __get_relative(relative, persons_by_id)
+        person.children.append(Child(relative['domainAttributes']['firstName'],
+                                     child_person.birthday_date if child_person else None))
+
+    # Sort children by age
+    person.children.sort(reverse=True)
+
+    # All children in one line
+    person.allChildren = ', '.join(str(child) for child in person.children)
+
+    return person
+
+@functools.lru_cache(maxsize=None)
+def _temp_image_dir():
+    path = tempfile.mkdtemp(prefix='churchtools-images-')
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+def add_images(persons, image_size=None, image_palette=False):
+    """Set the round profile image (PNG) of each person as person.image.
+
+    The persons only keep the path of the image file (in the image cache, or in a temporary
+    directory without one), which is read when rendering. So the images don't have to fit into memory.
+    """
+    start = time.perf_counter()
+    image_loader = churchtoolsimages.ImageLoader(image_cache_dir or _temp_image_dir(), max_concurrency,
+                                                 image_size, image_palette, placeholder_on_error=bool(journal))
+    images = image_loader.get_round_images([person.imageUrl for person in persons], as_paths=True)
+    for person, image in zip(persons, images):
+        person.image = image
+        if person.imageUrl in image_loader.failed:
+            _failed("Image of person {}".format(person.id), image_loader.failed[person.imageUrl])
+    logger.info("Loaded %d profile images in %.2fs", len(images), time.perf_counter() - start)
+
+def get_persons(filter_group_id=None, filter_role_id=None, include_images=False, image_size=None, image_palette=False,
+                include_relationships=True):
+    """Persons (sorted by family), optionally only those in the given group(s) with the given role(s).
+
+    filter_group_id and filter_role_id each take a single ID or a list of IDs.
+    With several groups, persons in any of them are returned.
+    Images are scaled down to image_size pixels and use 256 colors with image_palette.
+    Without include_relationships, the (per person) relationships aren't fetched: the persons
+    have no children and are sorted by name only.
+    households.iter_families() groups the returned persons by family.
+    """
+    # All persons by ID, to look up relatives without another request
+    with churchtoolsprofile.phase('get_persons/persons'):
+        persons = _get_all_persons()
+    persons_by_id = {person.id: person for person in persons}
+
+    # Filter only those in current group(s)
+    with churchtoolsprofile.phase('get_persons/groups'):
+        persons = filter_persons(persons, filter_group_id, filter_role_id)
+
+    # Copies, as postprocessing changes the fields of the persons in place
+    persons = [copy.copy(person) for person in persons]
+
+    # Relationships (spouses, children), runs in parallel
+    if include_relationships:
+        start = time.perf_counter()
+        with churchtoolsprofile.phase('get_persons/relationships'):
+            spouse_ids, child_relatives = _get_household_relationships(persons)
+            household_index = _get_households(persons, spouse_ids, child_relatives)
+        with churchtoolsprofile.phase('get_persons/children'):
+            persons = _map_concurrent(lambda person: __add_children(person, child_relatives[person.id], persons_by_id), persons)
+        logger.info("Fetched %d persons in %.2fs (max. %d parallel requests)",
+                    len(persons), time.perf_counter() - start, max_concurrency)
+    else:
+        household_index = households.Households(person.id for person in persons)
+    if snapshot and include_relationships:
+        last_sync = snapshot.last_sync
+        logger.info("Incremental: relationships of %d persons reused, %d fetched (last sync: %s)",
+                    snapshot.reused, snapshot.updated,
+                    datetime.datetime.fromtimestamp(last_sync).isoformat(timespec='minutes') if last_sync else "never")
+        snapshot.mark_synced()
+
+    # Profile pics (round)
+    if include_images:
+        with churchtoolsprofile.phase('get_persons/images'):
+            add_images(persons, image_size, image_palette)
 
     # Sort persons by their family
-    persons_sorted = sorted(persons, key = lambda p: (p['family_id'], p['sexId']))
-
-    # Cache result if in debug mode
-    if DEBUG:
-        with open(filename, 'wb') as f:
-            pickle.dump(persons_sorted, f)
-
-    return persons_sorted
-
-class Member:
-    personId = None
-    firstName = ''
-    lastName = ''
-    present = False # Whether the person was present in the meeting
-
-    def __hash__(self):
-        return hash(self.personId)
-
-    def __eq__(self, other):
-        return self.personId == other.personId
-
-    def __lt__(self, other):
-        return self.lastName + self.firstName < other.lastName + other.firstName
-
-    def __str__(self):
-        return "{lastName} {firstName}".format(firstName = self.firstName, lastName = self.lastName)
+    with churchtoolsprofile.phase('get_persons/sort'):
+        return [person for family in household_index.families(persons) for person in family.persons]
+
+# Birthday set in ChurchTools when the real one is unknown
+UNKNOWN_BIRTHDAY = datetime.date(1900, 1, 1)
+
+def _birthday_in_year(month_day, year):
+    """Date of the birthday in the given year. Feb 29 is on Mar 1 in other years."""
+    if month_day == (2, 29) and not calendar.isleap(year):
+        return datetime.date(year, 3, 1)
+    return datetime.date(year, *month_day)
+
+class BirthdayIndex:
+    """Persons sorted by the day of their birthday in the year, for queries like "birthdays in the last 7 days".
+
+    Persons without birthday (or with UNKNOWN_BIRTHDAY) are left out.
+    """
+
+    def __init__(self, persons):
+        entries = sorted(((p.birthday_date.month, p.birthday_date.day), i, p) for i, p in enumerate(persons)
+                         if p.birthday_date and p.birthday_date != UNKNOWN_BIRTHDAY)
+        self._days = [month_day for month_day, _, _ in entries]
+        self._persons = [person for _, _, person in entries]
+
+    def __len__(self):
+        return len(self._persons)
+
+    def between(self, start, end):
+        """(birthday, person) of the persons with birthday from start to end (dates, inclusive), sorted by birthday.
+
+        The birthday is the date in that range, so the range can span the turn of the year (or several years).
+        """
+        result = []
+        for year in range(start.year, end.year + 1):
+            first = (start.month, start.day) if year == start.year else (1, 1)
+            last = (end.month, end.day) if year == end.year else (12, 31)
+            if first == (3, 1) and not calendar.isleap(year):
+                first = (2, 29) # Their birthday is on Mar 1 this year
+            for i in range(bisect.bisect_left(self._days, first), bisect.bisect_right(self._days, last)):
+                result.append((_birthday_in_year(self._days[i], year), self._persons[i]))
+        return result
+
+    def next_days(self, days, start=None):
+        """Birthdays in the given number of days from start (default: today), see between()."""
+        start = start or datetime.date.today()
+        return self.between(start, start + datetime.timedelta(days=days - 1))
+
+    def last_days(self, days, end=None):
+        """Birthdays in the given number of days up to end (default: today), see between()."""
+        end = end or datetime.date.today()
+        return self.between(end - datetime.timedelta(days=days - 1), end)
+
+def _meeting_date(meeting):
+    """Local date of a meeting (startDate is in UTC)."""
+    start = datetime.datetime.fromisoformat(meeting['startDate'].replace('Z', '+00:00'))
+    return start.astimezone().date() if start.tzinfo else start.date()
+
+def get_group_meetings(group_id, start_date, end_date):
+    """Meetings of the group from start_date to end_date (inclusive), by date. One meeting per date."""
+    # End date must be one day more than the last date
+    end_date = end_date + datetime.timedelta(days=1)
+    group_url = _api_url('groups/{id}/meetings'.format(id=group_id))
+    meetings = {}
+    with churchtoolsprofile.phase('get_group_meetings'):
+        for meeting in _paginate(group_url, MAX_MEETINGS_LIMIT,
+                                 start_date=start_date.strftime("%Y-%m-%d"), end_date=end_date.strftime("%Y-%m-%d")):
+            meetings.setdefault(_meeting_date(meeting), meeting)
+    return meetings
 
 def get_group_meeting(group_id, meeting_date):
-    start_date_str = meeting_date.strftime("%Y-%m-%d")
-    # End date must be one day more than start date
-    end_date = meeting_date + datetime.timedelta(days=1)
-    end_date_str = end_date.strftime("%Y-%m-%d")
-    group_url = ApiBase._site + 'groups/{id}/meetings'.format(id=group_id)
-    meetings_in_group_result = Group.find(from_=group_url,
-        limit=1,
-        start_date=start_date_str, end_date=end_date_str)
-    meetings_in_group = meetings_in_group_result[0]['data']
-    return meetings_in_group[0] if meetings_in_group else None
+    return get_group_meetings(group_id, meeting_date, meeting_date).get(meeting_date)
 
 def get_meeting_members(group_id, meeting_id, filter_role_id=None):
-    url = ApiBase._site + 'groups/{groupId}/meetings/{meetingId}/members'.format(groupId=group_id, meetingId=meeting_id)
-    members_result = Group.find(from_=url)
-    members = members_result[0]['data']
+    url = _api_url('groups/{groupId}/meetings/{meetingId}/members'.format(groupId=group_id, meetingId=meeting_id))
+    members = _get(url)['data']
     new_members = []
     for member in members:
         if filter_role_id and int(member['member']['groupTypeRoleId']) != int(filter_role_id):
             continue
-        new_member = Member()
-        new_member.personId = member['member']['personId']
-        new_member.firstName = member['member']['person']['domainAttributes']['firstName']
-        new_member.lastName = member['member']['person']['domainAttributes']['lastName']
-        new_member.present = member['status'] == 'present'
-        new_members.append(new_member)
+        new_members.append(Member(member['member']['personId'],
+                                  member['member']['person']['domainAttributes']['firstName'],
+                                  member['member']['person']['domainAttributes']['lastName'],
+                                  member['status'] == 'present'))
     return new_members
+
+def get_meetings_members(group_id, meetings, filter_role_id=None):
+    """get_meeting_members() for several meetings at once (in parallel). Empty list for a meeting which is None."""
+    with churchtoolsprofile.phase('get_meetings_members'):
+        return _map_concurrent(
+            lambda meeting: get_meeting_members(group_id, meeting['id'], filter_role_id) if meeting else [],
+            meetings)
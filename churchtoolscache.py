@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_FILENAME = ".churchtools-cache.sqlite"
+DEFAULT_MAX_SIZE = 200 * 1024 * 1024 # bytes
+
+# How long (in seconds) a response is used without asking the server again,
+# by API path. After that, it is revalidated (ETag/Last-Modified) if possible.
+TTLS = [
+    (re.compile(r'groups/\d+/meetings'), 10 * 60),
+    (re.compile(r'groups/\d+/members'), 60 * 60),
+    (re.compile(r'persons/\d+/relationships'), 12 * 60 * 60),
+    (re.compile(r'persons'), 60 * 60),
+]
+DEFAULT_TTL = 60 * 60
+
+def ttl_for(url):
+    for pattern, ttl in TTLS:
+        if pattern.search(url):
+            return ttl
+    return DEFAULT_TTL
+
+class CacheEntry:
+    def __init__(self, body, etag, last_modified, fetched_at):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, ttl):
+        return time.time() - self.fetched_at < ttl
+
+class ResponseCache:
+    """HTTP response cache in a SQLite file. Least recently used entries are evicted beyond max_size bytes."""
+
+    def __init__(self, filename=DEFAULT_CACHE_FILENAME, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            size INTEGER NOT NULL)""")
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return CacheEntry(*row)
+
+    def put(self, key, body, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (key, body, etag, last_modified, now, now, len(body)))
+            self._evict()
+            self._db.commit()
+
+    def touch(self, key):
+        """Mark an entry as fresh again (after the server confirmed it is unchanged)."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def _evict(self):
+        total_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+
+DEFAULT_SNAPSHOT_FILENAME = ".churchtools-snapshot.sqlite"
+# Relationship changes don't always change the modification date of both persons,
+# so refetch them after a while anyway
+MAX_SNAPSHOT_AGE = 30 * 24 * 60 * 60 # seconds
+
+class Snapshot:
+    """Relationships of persons from earlier runs, along with the modification date of the person at that time.
+
+    As long as a person was not modified since, their relationships don't need to be fetched again.
+    """
+
+    def __init__(self, filename=DEFAULT_SNAPSHOT_FILENAME):
+        self.reused = 0
+        self.updated = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS relationships (
+            person_id INTEGER PRIMARY KEY,
+            modified TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            data TEXT NOT NULL)""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sync (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+
+    @property
+    def last_sync(self):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM sync WHERE key = 'last_sync'").fetchone()
+        return float(row[0]) if row else None
+
+    def mark_synced(self):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO sync VALUES ('last_sync', ?)", (str(time.time()),))
+            self._db.commit()
+
+    def get_relationships(self, person_id, modified):
+        """Relationships of the person, if the person was not modified since they were stored (else None)."""
+        if not modified:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT data FROM relationships WHERE person_id = ? AND modified = ? AND fetched_at > ?",
+                                   (person_id, modified, time.time() - MAX_SNAPSHOT_AGE)).fetchone()
+        if not row:
+            return None
+        self.reused += 1
+        return json.loads(row[0])
+
+    def put_relationships(self, person_id, modified, relationships):
+        if not modified:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO relationships VALUES (?, ?, ?, ?)",
+                             (person_id, modified, time.time(), json.dumps(relationships)))
+            self._db.commit()
+        self.updated += 1
+
+DEFAULT_JOURNAL_FILENAME = ".churchtools-checkpoint.sqlite"
+# The progress of an aborted run is only resumed for this long, so old data isn't reused when resuming much later
+MAX_JOURNAL_AGE = 24 * 60 * 60 # seconds
+
+class Journal:
+    """Progress of a run (e.g. the relationships fetched per person), so a rerun after a failure can resume.
+
+    Entries are stored by kind and key, e.g. ('relationships', person ID), and are used for up to
+    MAX_JOURNAL_AGE. The journal is meant to be removed once a run completed (see churchtoolsapi.configure()).
+    """
+
+    def __init__(self, filename=DEFAULT_JOURNAL_FILENAME):
+        self.filename = filename
+        self.resumed = 0
+        self.stored = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS progress (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            stored_at REAL NOT NULL,
+            PRIMARY KEY (kind, key))""")
+        self._db.commit()
+
+    def count(self):
+        """Number of stored entries."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM progress WHERE stored_at > ?",
+                                    (time.time() - MAX_JOURNAL_AGE,)).fetchone()[0]
+
+    def get(self, kind, key):
+        """The stored data (None if there is none)."""
+        with self._lock:
+            row = self._db.execute("SELECT data FROM progress WHERE kind = ? AND key = ? AND stored_at > ?",
+                                   (kind, str(key), time.time() - MAX_JOURNAL_AGE)).fetchone()
+        if not row:
+            return None
+        self.resumed += 1
+        return json.loads(row[0])
+
+    def put(self, kind, key, data):
+        # Committed right away, so it is kept even if the run is aborted right after
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?)",
+                             (kind, str(key), json.dumps(data), time.time()))
+            self._db.commit()
+        self.stored += 1
+
+    def remove(self):
+        with self._lock:
+            self._db.close()
+            os.remove(self.filename)
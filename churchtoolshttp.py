@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import churchtoolsprofile
+
+# Responses worth trying again: rate limit and temporary server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+BACKOFF_BASE = 1 # seconds
+BACKOFF_MAX = 60 # seconds
+REQUEST_TIMEOUT = 60 # seconds
+
+# Settings of the shared session (change them before the first request)
+pool_size = 4
+max_retries = 5
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """The requests session shared by all requests, so connections are kept alive and reused."""
+    global _session
+    import requests
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+def _retry_after(response):
+    """Seconds to wait according to the Retry-After header (None if there is none)."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+def _backoff(attempt):
+    # Exponential backoff with full jitter, so parallel requests don't retry all at once
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def get(url, headers=None):
+    """GET url through the shared session.
+
+    Rate limited (429) and failed (5xx, connection errors) requests are retried up to max_retries times.
+    Raises requests.HTTPError for error responses.
+    """
+    import requests
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        try:
+            response = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            churchtoolsprofile.record_request(url, None, 0, time.perf_counter() - start)
+            if attempt == max_retries:
+                raise
+            delay = _backoff(attempt)
+            logger.warning("%s failed (%s), retrying in %.1fs", url, e, delay)
+        else:
+            churchtoolsprofile.record_request(url, response.status_code, len(response.content),
+                                              time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                response.raise_for_status()
+                return response
+            delay = _retry_after(response)
+            if delay is None:
+                delay = _backoff(attempt)
+            # Don't let the server stall a worker for longer than the backoff would
+            delay = min(delay, BACKOFF_MAX)
+            logger.warning("%s returned %d, retrying in %.1fs", url, response.status_code, delay)
+        time.sleep(delay)
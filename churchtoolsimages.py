@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import functools
+import hashlib
+import io
+import logging
+import os
+import re
+import zipfile
+
+import churchtoolshttp
+import churchtoolsprofile
+
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_IMAGE_CACHE_DIR = ".churchtools-images"
+PLACEHOLDER_PATH = os.path.join(os.path.realpath(os.path.dirname(__file__)), 'images', 'placeholder.png')
+
+# Resolution the images are scaled to, for the size they have in the template
+DEFAULT_DPI = 300
+
+# Number of images loaded at once, when they are kept in files
+BATCH_SIZE = 200
+
+logger = logging.getLogger(__name__)
+
+def image_size_for_template(template_path, dpi=DEFAULT_DPI):
+    """Size in pixels matching the largest image frame (py3o.image with a width in cm) in the template."""
+    with zipfile.ZipFile(template_path) as odt:
+        content = odt.read('content.xml').decode('utf-8')
+    widths = [float(width) for width in re.findall(r"py3o\.image\([^)]*width=&apos;([\d.]+)cm&apos;", content)]
+    if not widths:
+        return None
+    return round(max(widths) / 2.54 * dpi)
+
+# From https://note.nkmk.me/en/python-pillow-square-circle-thumbnail/
+@functools.lru_cache(maxsize=None)
+def __circle_mask(size, blur_radius, offset=0):
+    """Mask for an image of the given size. Cached, as most images have the same size."""
+    from PIL import Image, ImageDraw, ImageFilter
+    offset = blur_radius * 2 + offset
+    mask = Image.new("L", size, 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((offset, offset, size[0] - offset, size[1] - offset), fill=255)
+    return mask.filter(ImageFilter.GaussianBlur(blur_radius))
+
+def __mask_circle_transparent(pil_img, blur_radius, offset=0):
+    result = pil_img.copy()
+    result.putalpha(__circle_mask(pil_img.size, blur_radius, offset))
+    return result
+
+def make_img_round(img_bytes, size=None, palette=False):
+    """Round PNG from the given image, scaled down to fit size x size pixels.
+
+    With palette, the PNG uses a palette of 256 colors, which makes it a lot smaller.
+    """
+    from PIL import Image
+    # Grayscale and palette images can't be masked and quantized, so convert them first
+    im = Image.open(io.BytesIO(img_bytes)).convert('RGBA')
+    if size and (im.width > size or im.height > size):
+        im.thumbnail((size, size), Image.LANCZOS)
+    im_round = __mask_circle_transparent(im, 0, 2)
+    if palette:
+        im_round = im_round.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    img_byte_arr = io.BytesIO()
+    im_round.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+def _make_img_round_or_error(img_bytes, size=None, palette=False):
+    """make_img_round(), but returns the exception instead of raising it (e.g. for images PIL can't open)."""
+    try:
+        return make_img_round(img_bytes, size, palette)
+    except Exception as e:
+        return e
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+class ImageLoader:
+    """Downloads profile images and makes them round.
+
+    With a cache_dir, both the downloaded images (by URL) and the round images
+    (by hash of the downloaded image) are kept on disk for the next run.
+    With placeholder_on_error, images that can't be downloaded or opened are replaced by
+    the placeholder instead of failing, and listed in failed (URL -> error).
+    """
+
+    def __init__(self, cache_dir=None, max_concurrency=4, size=None, palette=False, placeholder_on_error=False):
+        self.cache_dir = cache_dir
+        self.max_concurrency = max_concurrency
+        self.size = size
+        self.palette = palette
+        self.placeholder_on_error = placeholder_on_error
+        self.failed = {}
+        if cache_dir:
+            os.makedirs(os.path.join(cache_dir, 'raw'), exist_ok=True)
+            os.makedirs(os.path.join(cache_dir, 'round'), exist_ok=True)
+
+    def _cache_path(self, kind, key):
+        return os.path.join(self.cache_dir, kind, key)
+
+    def _read_cache(self, kind, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(kind, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_cache(self, kind, key, data):
+        if not self.cache_dir:
+            return
+        path = self._cache_path(kind, key)
+        # Write to a temporary file first, so no half-written file is left behind
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def download(self, url):
+        """The image at url (or the placeholder image if url is empty)."""
+        if not url:
+            return _placeholder()
+        url_hash = _sha256(url.encode())
+        img_bytes = self._read_cache('raw', url_hash)
+        if img_bytes is None:
+            churchtoolsprofile.count('image cache: misses')
+            try:
+                img_bytes = churchtoolshttp.get(url).content
+            except Exception as e:
+                if not self.placeholder_on_error:
+                    raise
+                self.failed[url] = e
+                return _placeholder()
+            self._write_cache('raw', url_hash, img_bytes)
+        else:
+            churchtoolsprofile.count('image cache: hits')
+        return img_bytes
+
+    def get_round_images(self, urls, as_paths=False):
+        """Round PNG images for the given image URLs (empty URL = placeholder), in the same order.
+
+        With as_paths (and a cache_dir), the paths of the cached image files are returned instead of the images.
+        Then the images are loaded in batches, so only the images of one batch are in memory at a time.
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        round_by_url = {}
+        round_by_hash = {}
+        downloaded = embedded = 0
+        batch_size = BATCH_SIZE if as_paths and self.cache_dir else max(len(unique_urls), 1)
+        for start in range(0, len(unique_urls), batch_size):
+            batch_urls = unique_urls[start:start + batch_size]
+            with churchtoolsprofile.phase('images/download'), \
+                 ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                raw_images = list(executor.map(self.download, batch_urls))
+            hashes = [_sha256(img_bytes) for img_bytes in raw_images]
+
+            # By hash, so identical images (e.g. the placeholder) are only made round once
+            round_key = '-{}{}'.format(self.size or 'orig', '-palette' if self.palette else '')
+            raw_by_hash = {img_hash: img_bytes for img_hash, img_bytes in zip(hashes, raw_images)
+                           if img_hash not in round_by_hash}
+            round_images = {img_hash: self._read_cache('round', img_hash + round_key) for img_hash in raw_by_hash}
+            to_round = [img_hash for img_hash, round_img in round_images.items() if round_img is None]
+
+            # Making images round is CPU bound, so use several processes for it
+            from concurrent.futures import ProcessPoolExecutor
+            make_round = functools.partial(_make_img_round_or_error if self.placeholder_on_error else make_img_round,
+                                           size=self.size, palette=self.palette)
+            with churchtoolsprofile.phase('images/round'):
+                if len(to_round) > 1:
+                    with ProcessPoolExecutor() as executor:
+                        rounded = list(executor.map(make_round, (raw_by_hash[img_hash] for img_hash in to_round)))
+                else:
+                    rounded = [make_round(raw_by_hash[img_hash]) for img_hash in to_round]
+            churchtoolsprofile.count('round image cache: hits', len(round_images) - len(to_round))
+            churchtoolsprofile.count('round image cache: misses', len(to_round))
+            failed_hashes = set()
+            for img_hash, round_img in zip(to_round, rounded):
+                if isinstance(round_img, Exception):
+                    # Not cached, so it is tried again next time
+                    failed_hashes.add(img_hash)
+                    self.failed.update((url, round_img) for url, url_hash in zip(batch_urls, hashes) if url_hash == img_hash)
+                    continue
+                round_images[img_hash] = round_img
+                self._write_cache('round', img_hash + round_key, round_img)
+            if failed_hashes:
+                placeholder_hash = _sha256(_placeholder())
+                if placeholder_hash not in round_images and placeholder_hash not in round_by_hash:
+                    round_images[placeholder_hash] = make_img_round(_placeholder(), self.size, self.palette)
+                    self._write_cache('round', placeholder_hash + round_key, round_images[placeholder_hash])
+                for img_hash in failed_hashes:
+                    del round_images[img_hash]
+                hashes = [placeholder_hash if img_hash in failed_hashes else img_hash for img_hash in hashes]
+
+            downloaded += sum(len(img_bytes) for img_bytes in raw_by_hash.values())
+            embedded += sum(len(round_img) for round_img in round_images.values())
+            if as_paths and self.cache_dir:
+                round_images = {img_hash: self._cache_path('round', img_hash + round_key) for img_hash in round_images}
+            round_by_hash.update(round_images)
+            round_by_url.update((url, round_by_hash[img_hash]) for url, img_hash in zip(batch_urls, hashes))
+
+        logger.info("Profile images: %d KB downloaded, %d KB to embed (%s px%s)",
+                    downloaded // 1024, embedded // 1024,
+                    self.size or "original", ", 256 colors" if self.palette else "")
+
+        return [round_by_url[url] for url in urls]
+
+@functools.lru_cache(maxsize=None)
+def _placeholder():
+    with open(PLACEHOLDER_PATH, 'rb') as f:
+        return f.read()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+# Upper bounds (seconds) of the buckets of the request latency histograms
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# Settings (see churchtoolsapi.configure())
+enabled = False
+render_profile = None # Write cProfile stats of rendering to this file
+
+_lock = threading.Lock()
+_phases = collections.OrderedDict() # name -> [count, seconds]
+_requests = {} # endpoint -> dict(count, bytes, seconds, statuses, latency histogram)
+_counters = collections.Counter()
+
+@contextlib.contextmanager
+def phase(name):
+    """Time the code in the with block as the given phase (names like "get_persons/relationships")."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            timing = _phases.setdefault(name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+
+def endpoint(url):
+    """URL without host and query, with IDs replaced, e.g. /api/persons/{id}/relationships."""
+    return re.sub(r'/\d+(?=/|$|\.)', '/{id}', urllib.parse.urlparse(url).path)
+
+def record_request(url, status, size, seconds):
+    """Count an HTTP request (status is None if it failed without response)."""
+    if not enabled:
+        return
+    with _lock:
+        stats = _requests.setdefault(endpoint(url), dict(
+            count=0, bytes=0, seconds=0.0, statuses=collections.Counter(), latency=[0] * len(LATENCY_BUCKETS)))
+        stats['count'] += 1
+        stats['bytes'] += size
+        stats['seconds'] += seconds
+        stats['statuses'][str(status) if status else 'error'] += 1
+        stats['latency'][next(i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)] += 1
+
+def count(name, n=1):
+    """Increase a counter, e.g. cache hits."""
+    if enabled:
+        with _lock:
+            _counters[name] += n
+
+@contextlib.contextmanager
+def render_profiler(output):
+    """cProfile the code in the with block if render_profile is set.
+
+    The stats are written to render_profile, with the name of the rendered file added,
+    e.g. render.prof -> render-memberlist.prof.
+    """
+    if not render_profile:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        base, ext = os.path.splitext(render_profile)
+        profiler.dump_stats('{}-{}{}'.format(base, os.path.splitext(os.path.basename(output))[0], ext))
+
+def _hit_rates():
+    """Share of the "<cache>: hits" counter in all "<cache>: ..." counters, for the caches with hits or misses."""
+    totals = collections.Counter()
+    for name, n in _counters.items():
+        totals[name.split(': ')[0]] += n
+    return {cache: _counters[cache + ': hits'] / total for cache, total in totals.items()
+            if (cache + ': hits' in _counters or cache + ': misses' in _counters) and total}
+
+def trace():
+    """All measurements as a dict (for JSON)."""
+    with _lock:
+        return dict(
+            phases={name: dict(count=n, seconds=round(seconds, 4)) for name, (n, seconds) in _phases.items()},
+            requests={name: dict(count=stats['count'], bytes=stats['bytes'], seconds=round(stats['seconds'], 4),
+                                 statuses=dict(stats['statuses']),
+                                 latency={('<={}'.format(bound) if bound != float('inf') else 'more'): n
+                                          for bound, n in zip(LATENCY_BUCKETS, stats['latency'])})
+                      for name, stats in sorted(_requests.items())},
+            counters=dict(_counters),
+            hitRates={cache: round(rate, 4) for cache, rate in _hit_rates().items()},
+        )
+
+def _percentile(histogram, share):
+    """Upper bound of the latency bucket containing the given share of the requests."""
+    total = sum(histogram)
+    seen = 0
+    for bound, n in zip(LATENCY_BUCKETS, histogram):
+        seen += n
+        if seen >= share * total:
+            return bound
+    return LATENCY_BUCKETS[-1]
+
+def summary():
+    """The measurements as a table."""
+    lines = ["{:<40} {:>7} {:>10}".format("Phase", "count", "seconds")]
+    with _lock:
+        for name, (n, seconds) in _phases.items():
+            lines.append("{:<40} {:>7} {:>10.2f}".format(name, n, seconds))
+        lines.append("")
+        lines.append("{:<40} {:>7} {:>10} {:>10} {:>8} {:>8}".format(
+            "Endpoint", "count", "KB", "seconds", "p50 <=", "p95 <="))
+        for name, stats in sorted(_requests.items()):
+            lines.append("{:<40} {:>7} {:>10} {:>10.2f} {:>8} {:>8}".format(
+                name, stats['count'], stats['bytes'] // 1024, stats['seconds'],
+                _percentile(stats['latency'], 0.5), _percentile(stats['latency'], 0.95)))
+        if _counters:
+            lines.append("")
+            for name, n in sorted(_counters.items()):
+                lines.append("{:<40} {:>7}".format(name, n))
+            for cache, rate in sorted(_hit_rates().items()):
+                lines.append("{:<40} {:>7.0%}".format(cache + ": hit rate", rate))
+    return "\n".join(lines)
+
+def write_trace(filename):
+    with open(filename, 'w') as f:
+        json.dump(trace(), f, indent=2)
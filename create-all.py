@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import os
+
+import churchtoolsapi
+import churchtoolsimages
+import churchtoolsprofile
+import documents
+
+from concurrent.futures import ProcessPoolExecutor
+
+DOCUMENTS = ['memberlist', 'prayerlist', 'checkinform', 'birthdays']
+
+# Parse arguments
+parser = argparse.ArgumentParser(description="Create several documents at once, fetching the data only once")
+parser.add_argument("--documents", default=','.join(DOCUMENTS),
+                    help="Comma separated list of documents to create (default: {})".format(','.join(DOCUMENTS)))
+parser.add_argument("--group-members", help="Group ID where to find Church members")
+parser.add_argument("--group-regularvisitors", help="Group ID where to find regular visitors")
+parser.add_argument("--role-id-regularvisitors", help="Only visitors with this role ID")
+parser.add_argument("--group-visitors", help="Group ID where to find other visitors")
+parser.add_argument("--role-id-visitors", help="Only visitors with this role ID")
+parser.add_argument("--surname-from", help="Prayer list: Only include surname larger than this letter(s)")
+parser.add_argument("--surname-to", help="Prayer list: Only include surname up than this letter(s)")
+parser.add_argument("--birthday-days", type=int, default=7,
+                    help="Check-in form and birthdays: Birthdays of this many days up to next Sunday (default: 7)")
+parser.add_argument("--template-dir", default=".", help="Directory with the templates (template_<document>.odt)")
+parser.add_argument("--output-dir", default=".", help="Directory to write the documents to (<document>.odt)")
+parser.add_argument("--image-size", type=int, help="Scale profile images down to this size in pixels "
+                    "(default: size of the largest image in the templates at {} dpi)".format(churchtoolsimages.DEFAULT_DPI))
+parser.add_argument("--image-palette", action="store_true", help="Use only 256 colors for profile images (smaller output file)")
+parser.add_argument("--render-processes", type=int, default=len(DOCUMENTS), help="Number of documents to render in parallel")
+churchtoolsapi.add_arguments(parser)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    churchtoolsapi.configure(args)
+    template_path = lambda document: os.path.join(args.template_dir, "template_{}.odt".format(document))
+    output_path = lambda document: os.path.join(args.output_dir, "{}.odt".format(document))
+    selected = args.documents.split(',')
+    for document in selected:
+        if document not in DOCUMENTS:
+            parser.error("Unknown document: {}".format(document))
+
+    # All persons are downloaded only once and shared by the get_persons() calls.
+    # The relationships are only needed to sort the members by family (in all documents but the birthdays,
+    # which are sorted by date), so the documents are the same whichever others are selected.
+    members = churchtoolsapi.get_persons(args.group_members,
+        include_relationships=any(document != 'birthdays' for document in selected))
+    regularvisitors = churchtoolsapi.get_persons(args.group_regularvisitors, args.role_id_regularvisitors,
+                                                 include_relationships=False)
+    visitors = churchtoolsapi.get_persons(args.group_visitors, args.role_id_visitors, include_relationships=False)
+
+    # Images only for the lists that show them, once in the largest size needed
+    with_images = [document for document in selected if document in ('memberlist', 'prayerlist')]
+    if with_images:
+        image_size = args.image_size
+        if not image_size:
+            template_sizes = [churchtoolsimages.image_size_for_template(template_path(document)) for document in with_images]
+            image_size = max((size for size in template_sizes if size), default=None)
+        churchtoolsapi.add_images(members, image_size, args.image_palette)
+
+    renders = []
+    if 'memberlist' in selected:
+        renders.append(('memberlist', documents.memberlist_data(members)))
+    if 'prayerlist' in selected:
+        renders.append(('prayerlist', documents.prayerlist_data(members, args.surname_from, args.surname_to)))
+    if 'checkinform' in selected:
+        renders.append(('checkinform', documents.checkinform_data(members, regularvisitors, visitors, args.birthday_days)))
+    if 'birthdays' in selected:
+        for line in documents.birthday_lines(members + regularvisitors, args.birthday_days):
+            print(line)
+
+    # The documents are independent of each other, so render them in parallel
+    if args.render_processes > 1 and len(renders) > 1:
+        with churchtoolsprofile.phase('render'), ProcessPoolExecutor(max_workers=args.render_processes) as executor:
+            futures = [executor.submit(documents.render, template_path(document), output_path(document), data)
+                       for document, data in renders]
+            for future in futures:
+                future.result()
+    else:
+        for document, data in renders:
+            documents.render(template_path(document), output_path(document), data)
+
+    churchtoolsapi.finish_run()
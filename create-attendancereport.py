@@ -8,10 +8,15 @@
 
 import argparse
 import datetime
+import logging
+import os
 
+import attendance
 import churchtoolsapi
+import churchtoolsprofile
+import documents
 
-from py3o.template import Template
+from concurrent.futures import ProcessPoolExecutor
 
 # Parse arguments
 parser = argparse.ArgumentParser()
@@ -21,138 +26,183 @@ parser.add_argument("--role-id-regularvisitors", help="Only visitors with this r
 parser.add_argument("--group-visitors", help="Group ID where to find sporadic visitors")
 parser.add_argument("--role-id-visitors", help="Only visitors with this role ID")
 parser.add_argument("--date", help="Service date. Format: YYYY-MM-DD; e.g. '2022-05-21'")
+parser.add_argument("--from", dest="date_from", help="Create a report for each service from this date on (instead of --date). Format: YYYY-MM-DD")
+parser.add_argument("--to", dest="date_to", help="Create a report for each service up to this date (instead of --date). Format: YYYY-MM-DD")
+parser.add_argument("--render-processes", type=int, default=1, help="Number of reports to render in parallel (with --from/--to)")
+parser.add_argument("--weeks", type=int, default=8, help="Number of weeks to look back for frequently absent members")
+parser.add_argument("--threshold", type=int, default=4, help="Members absent at least this many times in these weeks are frequently absent")
 parser.add_argument("--template", default="template_attendancereport.odt", help="custom template file (odt)")
 parser.add_argument("--output", default="attendancereport.odt", help="output file (odt)")
 parser.add_argument("--txt-output", help="output file (txt)", default=None)
-args = parser.parse_args()
-
-def is_absent(member):
-    return member.present == False
-
-def get_two_weeks_absent(meeting_members):
-    if len(meeting_members) < 2:
-        return []
-    thisWeekAbsent = set(filter(is_absent, meeting_members[0]))
-    lastWeekAbsent = set(filter(is_absent, meeting_members[1]))
-    return sorted(thisWeekAbsent.intersection(lastWeekAbsent))
-
-def get_last_eight_weeks_absent(meeting_members):
-    meetings_only_absent_members = []
-    for members in meeting_members:
-        meetings_only_absent_members.append(filter(is_absent, members))
-
-    members_with_absent_count = []
-    for members in meetings_only_absent_members:
-        for member in members:
-            if member in members_with_absent_count:
-                m = members_with_absent_count[members_with_absent_count.index(member)]
-                m.absentCount += 1
-                continue
-            member.absentCount = 1
-            members_with_absent_count.append(member)
+churchtoolsapi.add_arguments(parser)
 
-    return list(filter(lambda member: member.absentCount >= 4, members_with_absent_count))
+logger = logging.getLogger(__name__)
 
 def get_present(meeting_members):
     return list(filter(lambda member: member.present == True, meeting_members))
 
-# Create template
-t = Template(args.template, args.output)
-
-orig_meeting_date = churchtoolsapi.str_to_date(args.date)
-
-## Fetch members data
-# This week = meeting_members[0], 8 weeks ago = meeting_members[7]
-meeting_members = []
-meeting_members_stats = []
-log = []
-for nWeek in range(8):
-    meeting_date = orig_meeting_date + datetime.timedelta(weeks=-(nWeek))
-    meeting = churchtoolsapi.get_group_meeting(args.group_members, meeting_date)
-    if not meeting:
-        log.append("Kein Treffen für {} gefunden!".format(meeting_date.strftime("%Y-%m-%d")))
-        meeting_members.append([])
-        continue
-    if not meeting['isCompleted']:
-        log.append("Mitglieder-Anwesenheit vom {} nicht abgeschlossen.".format(meeting_date.strftime("%Y-%m-%d")))
-        break
-    meeting_members_stats.append(meeting)
-    meeting_members.append(churchtoolsapi.get_meeting_members(args.group_members, meeting['id']))
-
-## Fetch regular visitors data
-meeting_regular_visitors = []
-meeting_regular_visitors_stats = []
-for nWeek in range(2):
-    meeting_date = orig_meeting_date + datetime.timedelta(weeks=-(nWeek))
-    meeting = churchtoolsapi.get_group_meeting(args.group_regular_visitors, meeting_date)
-    if not meeting:
-        continue
-    if not meeting['isCompleted']:
-        log.append("Regelmäßige Besucher-Anwesenheit vom {} nicht abgeschlossen.".format(meeting_date.strftime("%Y-%m-%d")))
-        break
-    meeting_regular_visitors_stats.append(meeting)
-    meeting_regular_visitors.append(
-        churchtoolsapi.get_meeting_members(
-            args.group_regular_visitors,
-            meeting['id'],
-            args.role_id_regularvisitors))
-
-## Fetch other visitors data
-#other_visitors = churchtoolsapi.get_persons(args.group_visitors, args.role_id_visitors)
-
-# Member absences
-twoWeeksAbsentMembers = get_two_weeks_absent(meeting_members)
-fourTimesInEightWeeksAbsent = get_last_eight_weeks_absent(meeting_members)
-
-# Regular visitors absences
-presentRegularVisitors_ = get_present(meeting_regular_visitors[0])
-twoWeeksAbsentRegularVisitors = get_two_weeks_absent(meeting_regular_visitors)
-
-# Other visitors
-comment_members = meeting_members_stats[0]['comment'] if meeting_members_stats[0]['comment'] else ""
-comment_regular_visitors = meeting_regular_visitors_stats[0]['comment'] if meeting_regular_visitors_stats[0]['comment'] else ""
-other_visitors = (comment_members + comment_regular_visitors).split("\n")
-
-data = dict(
-    meetingDate=churchtoolsapi.format_date(args.date),
-    membersPresentCount = meeting_members_stats[0]['statistics']['present'],
-    membersAbsentCount = meeting_members_stats[0]['statistics']['absent'],
-    numGuests = meeting_members_stats[0]['numGuests'],
-    absentLastTwoSundays = twoWeeksAbsentMembers,
-    absentLastEightWeeks = fourTimesInEightWeeksAbsent,
-    absentVisitorsLastTwoSundays = twoWeeksAbsentRegularVisitors,
-    presentRegularVisitors = presentRegularVisitors_,
-    regularVisitorsPresentCount = meeting_regular_visitors_stats[0]['statistics']['present'],
-    regularVisitorsAbsentCount = meeting_regular_visitors_stats[0]['statistics']['absent'],
-    presentVisitors = other_visitors
-)
-
-if (args.txt_output):
-    with open(args.txt_output, 'w') as f:
-        f.write("=== Anwesenheitsbericht für {} ===\n".format(data['meetingDate']))
-        f.write("\n** Mitglieder **")
-        f.write("\n{} anwesend, {} abwesend\n".format(data['membersPresentCount'], data['membersAbsentCount']))
-        f.write("\nAbwesende Mitglieder in den letzten zwei Sonntagen:\n")
-        for member in data['absentLastTwoSundays']:
-            f.write("- {} {}\n".format(member.firstName, member.lastName))
-        f.write("\nHäufig abwesende Mitglieder in den letzten acht Wochen:\n")
-        for member in data['absentLastEightWeeks']:
-            f.write("- {} {} ({} Abwesenheiten)\n".format(member.firstName, member.lastName, member.absentCount))
-        f.write("\n")
-        f.write("\n** Regelmäßige Besucher **")
-        f.write("\n{} anwesend, {} abwesend\n".format(data['regularVisitorsPresentCount'], data['regularVisitorsAbsentCount']))
-        f.write("\nAnwesende regelmäßige Besucher:\n")
-        for visitor in data['presentRegularVisitors']:
-            f.write("- {} {}\n".format(visitor.firstName, visitor.lastName))
-        f.write("\nAbwesende regelmäßige Besucher in den letzten zwei Sonntagen:\n")
-        for visitor in data['absentVisitorsLastTwoSundays']:
-            f.write("- {} {}\n".format(visitor.firstName, visitor.lastName))
-        f.write("\nAndere Besucher:\n")
-        for visitor in data['presentVisitors']:
-            f.write("- {}\n".format(visitor))
-        if log:
-            f.write ("\n\n** Log **\n")
-            for log_entry in log:
-                f.write("- {}\n".format(log_entry))
-
-t.render(data)
+def output_for_date(filename, meeting_date):
+    """Output file name for the report of one date, e.g. attendancereport_2022-05-22.odt"""
+    if not filename:
+        return None
+    base, ext = os.path.splitext(filename)
+    return "{}_{}{}".format(base, meeting_date.strftime("%Y-%m-%d"), ext)
+
+def get_members_by_meeting(group_id, meetings, filter_role_id=None):
+    """Members of all completed meetings, by meeting ID."""
+    completed_meetings = [meeting for meeting in meetings if meeting['isCompleted']]
+    members = churchtoolsapi.get_meetings_members(group_id, completed_meetings, filter_role_id)
+    return {meeting['id']: meeting_members for meeting, meeting_members in zip(completed_meetings, members)}
+
+def get_report_data(orig_meeting_date, member_meetings, members_by_meeting,
+                    regular_visitor_meetings, regular_visitors_by_meeting, weeks, threshold):
+    """Data for the report of one date, from the meetings (by date) and their members (by meeting ID)."""
+    ## Members data
+    # This week = meeting_members[0], 8 weeks ago = meeting_members[7]
+    meeting_members = []
+    meeting_members_stats = []
+    log = []
+    for nWeek in range(weeks):
+        meeting_date = orig_meeting_date + datetime.timedelta(weeks=-(nWeek))
+        meeting = member_meetings.get(meeting_date)
+        if not meeting:
+            log.append("Kein Treffen für {} gefunden!".format(meeting_date.strftime("%Y-%m-%d")))
+            meeting_members.append([])
+            continue
+        if not meeting['isCompleted']:
+            log.append("Mitglieder-Anwesenheit vom {} nicht abgeschlossen.".format(meeting_date.strftime("%Y-%m-%d")))
+            break
+        meeting_members_stats.append(meeting)
+        meeting_members.append(members_by_meeting[meeting['id']])
+
+    ## Regular visitors data
+    meeting_regular_visitors = []
+    meeting_regular_visitors_stats = []
+    for nWeek in range(2):
+        meeting_date = orig_meeting_date + datetime.timedelta(weeks=-(nWeek))
+        meeting = regular_visitor_meetings.get(meeting_date)
+        if not meeting:
+            continue
+        if not meeting['isCompleted']:
+            log.append("Regelmäßige Besucher-Anwesenheit vom {} nicht abgeschlossen.".format(meeting_date.strftime("%Y-%m-%d")))
+            break
+        meeting_regular_visitors_stats.append(meeting)
+        meeting_regular_visitors.append(regular_visitors_by_meeting[meeting['id']])
+
+    ## Other visitors data
+    #other_visitors = churchtoolsapi.get_persons(args.group_visitors, args.role_id_visitors)
+
+    # Member absences
+    member_attendance = attendance.AttendanceMatrix(meeting_members)
+    twoWeeksAbsentMembers = member_attendance.absent_in_a_row(2)
+    frequentlyAbsentMembers = member_attendance.absent_at_least(threshold)
+
+    # Regular visitors absences
+    presentRegularVisitors_ = get_present(meeting_regular_visitors[0])
+    twoWeeksAbsentRegularVisitors = attendance.AttendanceMatrix(meeting_regular_visitors).absent_in_a_row(2)
+
+    # Other visitors
+    comment_members = meeting_members_stats[0]['comment'] if meeting_members_stats[0]['comment'] else ""
+    comment_regular_visitors = meeting_regular_visitors_stats[0]['comment'] if meeting_regular_visitors_stats[0]['comment'] else ""
+    other_visitors = (comment_members + comment_regular_visitors).split("\n")
+
+    data = dict(
+        meetingDate=orig_meeting_date.strftime("%d.%m.%Y"),
+        membersPresentCount = meeting_members_stats[0]['statistics']['present'],
+        membersAbsentCount = meeting_members_stats[0]['statistics']['absent'],
+        numGuests = meeting_members_stats[0]['numGuests'],
+        absentLastTwoSundays = twoWeeksAbsentMembers,
+        absentLastEightWeeks = frequentlyAbsentMembers,
+        absentVisitorsLastTwoSundays = twoWeeksAbsentRegularVisitors,
+        presentRegularVisitors = presentRegularVisitors_,
+        regularVisitorsPresentCount = meeting_regular_visitors_stats[0]['statistics']['present'],
+        regularVisitorsAbsentCount = meeting_regular_visitors_stats[0]['statistics']['absent'],
+        presentVisitors = other_visitors
+    )
+    return data, log
+
+def write_report(data, log, weeks, template, output, txt_output):
+    if txt_output:
+        with open(txt_output, 'w') as f:
+            f.write("=== Anwesenheitsbericht für {} ===\n".format(data['meetingDate']))
+            f.write("\n** Mitglieder **")
+            f.write("\n{} anwesend, {} abwesend\n".format(data['membersPresentCount'], data['membersAbsentCount']))
+            f.write("\nAbwesende Mitglieder in den letzten zwei Sonntagen:\n")
+            for member in data['absentLastTwoSundays']:
+                f.write("- {} {}\n".format(member.firstName, member.lastName))
+            f.write("\nHäufig abwesende Mitglieder in den letzten {} Wochen:\n".format(weeks))
+            for member in data['absentLastEightWeeks']:
+                f.write("- {} {} ({} Abwesenheiten)\n".format(member.firstName, member.lastName, member.absentCount))
+            f.write("\n")
+            f.write("\n** Regelmäßige Besucher **")
+            f.write("\n{} anwesend, {} abwesend\n".format(data['regularVisitorsPresentCount'], data['regularVisitorsAbsentCount']))
+            f.write("\nAnwesende regelmäßige Besucher:\n")
+            for visitor in data['presentRegularVisitors']:
+                f.write("- {} {}\n".format(visitor.firstName, visitor.lastName))
+            f.write("\nAbwesende regelmäßige Besucher in den letzten zwei Sonntagen:\n")
+            for visitor in data['absentVisitorsLastTwoSundays']:
+                f.write("- {} {}\n".format(visitor.firstName, visitor.lastName))
+            f.write("\nAndere Besucher:\n")
+            for visitor in data['presentVisitors']:
+                f.write("- {}\n".format(visitor))
+            if log:
+                f.write ("\n\n** Log **\n")
+                for log_entry in log:
+                    f.write("- {}\n".format(log_entry))
+
+    documents.render(template, output, data)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.date and (args.date_from or args.date_to):
+        parser.error("--date can't be combined with --from/--to")
+    if not args.date and not (args.date_from and args.date_to):
+        parser.error("Either --date or both --from and --to are required")
+    churchtoolsapi.configure(args)
+
+    if args.date:
+        first_date = last_date = churchtoolsapi.str_to_date(args.date)
+    else:
+        first_date = churchtoolsapi.str_to_date(args.date_from)
+        last_date = churchtoolsapi.str_to_date(args.date_to)
+
+    # Fetch all meetings (and their members) needed for all reports at once
+    member_meetings = churchtoolsapi.get_group_meetings(
+        args.group_members, first_date + datetime.timedelta(weeks=-(args.weeks - 1)), last_date)
+    members_by_meeting = get_members_by_meeting(args.group_members, member_meetings.values())
+    regular_visitor_meetings = churchtoolsapi.get_group_meetings(
+        args.group_regular_visitors, first_date + datetime.timedelta(weeks=-1), last_date)
+    regular_visitors_by_meeting = get_members_by_meeting(
+        args.group_regular_visitors, regular_visitor_meetings.values(), args.role_id_regularvisitors)
+
+    if args.date:
+        reports = [(first_date, args.output, args.txt_output)]
+    else:
+        # One report for each completed meeting of the members group
+        reports = []
+        for meeting_date in sorted(member_meetings):
+            if not first_date <= meeting_date <= last_date:
+                continue
+            regular_visitor_meeting = regular_visitor_meetings.get(meeting_date)
+            if not member_meetings[meeting_date]['isCompleted'] \
+                    or not regular_visitor_meeting or not regular_visitor_meeting['isCompleted']:
+                logger.warning("Skipping %s: attendance not completed", meeting_date.strftime("%Y-%m-%d"))
+                continue
+            reports.append((meeting_date, output_for_date(args.output, meeting_date),
+                            output_for_date(args.txt_output, meeting_date)))
+
+    reports_data = [get_report_data(meeting_date, member_meetings, members_by_meeting,
+                                    regular_visitor_meetings, regular_visitors_by_meeting, args.weeks, args.threshold)
+                    for meeting_date, _, _ in reports]
+
+    if args.render_processes > 1 and len(reports) > 1:
+        with churchtoolsprofile.phase('render'), ProcessPoolExecutor(max_workers=args.render_processes) as executor:
+            futures = [executor.submit(write_report, data, log, args.weeks, args.template, output, txt_output)
+                       for (data, log), (_, output, txt_output) in zip(reports_data, reports)]
+            for future in futures:
+                future.result()
+    else:
+        for (data, log), (_, output, txt_output) in zip(reports_data, reports):
+            write_report(data, log, args.weeks, args.template, output, txt_output)
+
+    churchtoolsapi.finish_run()
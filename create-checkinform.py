@@ -7,13 +7,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
-import datetime
-
-import dateutil.relativedelta as relativedelta
 
 import churchtoolsapi
-
-from py3o.template import Template
+import documents
 
 # Parse arguments
 parser = argparse.ArgumentParser()
@@ -22,40 +18,28 @@ parser.add_argument("--group-regularvisitors", help="Group ID where to find regu
 parser.add_argument("--role-id-regularvisitors", help="Only visitors with this role ID")
 parser.add_argument("--group-visitors", help="Group ID where to find other visitors")
 parser.add_argument("--role-id-visitors", help="Only visitors with this role ID")
+parser.add_argument("--birthday-days", type=int, default=7,
+                    help="Highlight the birthdays of this many days up to next Sunday (default: 7)")
 parser.add_argument("--template", default="template_checkinform.odt", help="custom template file (odt)")
 parser.add_argument("--output", default="checkinform.odt", help="output file (odt)")
+churchtoolsapi.add_arguments(parser)
 args = parser.parse_args()
+churchtoolsapi.configure(args)
 
-# Create template
-t = Template(args.template, args.output)
+# The members are sorted by family, which needs their relationships.
+# Of the visitors only the names are needed, so they are sorted by name without fetching relationships.
 
 # Members
 members_sorted = churchtoolsapi.get_persons(args.group_members)
 
 # Regular visitors
-regularvisitors_sorted = churchtoolsapi.get_persons(args.group_regularvisitors, args.role_id_regularvisitors)
+regularvisitors_sorted = churchtoolsapi.get_persons(args.group_regularvisitors, args.role_id_regularvisitors,
+                                                    include_relationships=False)
 
 # Other visitors
-visitors_sorted = churchtoolsapi.get_persons(args.group_visitors, args.role_id_visitors)
-
-next_sunday = datetime.date.today()
-if next_sunday.weekday() != 6: # Sunday
-    next_sunday += relativedelta.relativedelta(days=1, weekday=relativedelta.SU)
-next_sunday_date = next_sunday.strftime("%d.%m.%Y")
-
-# Highlight recent birthdays
-for member in members_sorted:
-    birthday = member['birthday_date']
-    birthday_highlight = ''
-    if birthday:
-        birthday = birthday.replace(year=next_sunday.year)
-        delta = (next_sunday - birthday)
-        if delta.days < 7 and delta.days >= 0:
-            if (delta.days == 0):
-                birthday_highlight = "heute!"
-            else:
-                birthday_highlight = birthday.strftime("%d.%m.")
-    member['birthdayHighlight'] = birthday_highlight
-
-data = dict(members=members_sorted, regularvisitors=regularvisitors_sorted, visitors=visitors_sorted, nextsunday=next_sunday_date)
-t.render(data)
+visitors_sorted = churchtoolsapi.get_persons(args.group_visitors, args.role_id_visitors, include_relationships=False)
+
+data = documents.checkinform_data(members_sorted, regularvisitors_sorted, visitors_sorted, args.birthday_days)
+documents.render(args.template, args.output, data)
+
+churchtoolsapi.finish_run()
@@ -9,22 +9,29 @@
 import argparse
 
 import churchtoolsapi
-
-from py3o.template import Template
+import churchtoolsimages
+import documents
 
 # Parse arguments
 parser = argparse.ArgumentParser()
 parser.add_argument("--filter-group", help="Filter for group ID")
 parser.add_argument("--filter-role", help="Filter for role ID")
 parser.add_argument("--template", default="template_memberlist.odt", help="custom template file (odt)")
+parser.add_argument("--image-size", type=int, help="Scale profile images down to this size in pixels "
+                    "(default: size of the image in the template at {} dpi)".format(churchtoolsimages.DEFAULT_DPI))
+parser.add_argument("--image-palette", action="store_true", help="Use only 256 colors for profile images (smaller output file)")
 parser.add_argument("--output", default="memberlist.odt", help="output file (odt)")
+churchtoolsapi.add_arguments(parser)
 args = parser.parse_args()
+churchtoolsapi.configure(args)
 
-# Create template
-t = Template(args.template, args.output)
+image_size = args.image_size or churchtoolsimages.image_size_for_template(args.template)
 
 # Sort persons by their family
-persons_sorted = churchtoolsapi.get_persons(args.filter_group, args.filter_role, include_images=True)
+persons_sorted = churchtoolsapi.get_persons(args.filter_group, args.filter_role, include_images=True,
+    image_size=image_size, image_palette=args.image_palette)
+
+data = documents.memberlist_data(persons_sorted)
+documents.render(args.template, args.output, data)
 
-data = dict(persons=persons_sorted)
-t.render(data)
+churchtoolsapi.finish_run()
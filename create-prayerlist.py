@@ -9,8 +9,8 @@
 import argparse
 
 import churchtoolsapi
-
-from py3o.template import Template
+import churchtoolsimages
+import documents
 
 # Parse arguments
 parser = argparse.ArgumentParser()
@@ -18,21 +18,21 @@ parser.add_argument("--filter-group", help="Filter for group ID")
 parser.add_argument("--surname-from", help="Only include surname larger than this letter(s)")
 parser.add_argument("--surname-to", help="Only include surname up than this letter(s)")
 parser.add_argument("--template", default="template_prayerlist.odt", help="custom template file (odt)")
+parser.add_argument("--image-size", type=int, help="Scale profile images down to this size in pixels "
+                    "(default: size of the image in the template at {} dpi)".format(churchtoolsimages.DEFAULT_DPI))
+parser.add_argument("--image-palette", action="store_true", help="Use only 256 colors for profile images (smaller output file)")
 parser.add_argument("--output", default="prayerlist.odt", help="output file (odt)")
+churchtoolsapi.add_arguments(parser)
 args = parser.parse_args()
+churchtoolsapi.configure(args)
 
-# Create template
-t = Template(args.template, args.output)
+image_size = args.image_size or churchtoolsimages.image_size_for_template(args.template)
 
 # Retrieve people
-persons = churchtoolsapi.get_persons(args.filter_group, include_images=True)
-
-if args.surname_from:
-    persons = filter(lambda p : p['lastName'] >= args.surname_from, persons)
-
-if args.surname_to:
-    persons = filter(lambda p : p['lastName'] <= args.surname_to, persons)
+persons = churchtoolsapi.get_persons(args.filter_group, include_images=True,
+    image_size=image_size, image_palette=args.image_palette)
 
+data = documents.prayerlist_data(persons, args.surname_from, args.surname_to)
+documents.render(args.template, args.output, data)
 
-data = dict(persons=persons)
-t.render(data)
+churchtoolsapi.finish_run()
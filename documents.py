@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import functools
+import os
+import tempfile
+
+import churchtoolsapi
+import churchtoolsprofile
+import households
+
+# The data for each document, built from the persons returned by churchtoolsapi.get_persons()
+
+def get_next_sunday():
+    today = datetime.date.today()
+    return today + datetime.timedelta(days=(6 - today.weekday()) % 7) # 6 = Sunday
+
+def memberlist_data(persons):
+    return dict(persons=persons, families=list(households.iter_families(persons)))
+
+def prayerlist_data(persons, surname_from=None, surname_to=None):
+    if surname_from:
+        persons = filter(lambda p : p.lastName >= surname_from, persons)
+
+    if surname_to:
+        persons = filter(lambda p : p.lastName <= surname_to, persons)
+
+    return dict(persons=list(persons))
+
+def checkinform_data(members, regularvisitors, visitors, birthday_days=7):
+    next_sunday = get_next_sunday()
+    next_sunday_date = next_sunday.strftime("%d.%m.%Y")
+
+    # Highlight recent birthdays
+    for member in members:
+        member.birthdayHighlight = ''
+    for birthday, member in churchtoolsapi.BirthdayIndex(members).last_days(birthday_days, next_sunday):
+        member.birthdayHighlight = "heute!" if birthday == next_sunday else birthday.strftime("%d.%m.")
+
+    return dict(members=members, regularvisitors=regularvisitors, visitors=visitors, nextsunday=next_sunday_date)
+
+def birthday_lines(persons, days=7):
+    """Lines listing the persons with birthday in the given number of days up to next Sunday, by birthday."""
+    return ["{} {} {}".format(person.firstName, person.lastName, birthday.strftime("%d.%m."))
+            for birthday, person in churchtoolsapi.BirthdayIndex(persons).last_days(days, get_next_sunday())]
+
+class _ImageFile(dict):
+    """Image of a document, read from its file only when the document is saved."""
+
+    def get(self, key, default=None):
+        if key == 'data':
+            with open(self['path'], 'rb') as f:
+                return f.read()
+        return super().get(key, default)
+
+@functools.lru_cache(maxsize=None)
+def _template_class():
+    from py3o.template import Template
+
+    class FileImagesTemplate(Template):
+        """Template which keeps the images in files instead of in memory until the document is saved.
+
+        The content itself is already rendered as a stream into a temporary file by py3o,
+        so memory use doesn't grow with the number of images.
+        """
+
+        def __init__(self, template, output, image_dir):
+            super().__init__(template, output)
+            self.image_dir = image_dir
+
+        def set_image_data(self, identifier, data, mime_type=None):
+            # The identifier is the hash of the image, so each image is only written once
+            path = os.path.join(self.image_dir, identifier.replace('/', '_'))
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    f.write(data)
+            self.images[identifier] = _ImageFile(path=path, mime_type=mime_type)
+
+    return FileImagesTemplate
+
+def render(template, output, data):
+    with churchtoolsprofile.phase('render'), churchtoolsprofile.render_profiler(output), \
+         tempfile.TemporaryDirectory(prefix='churchtools-render-') as image_dir:
+        t = _template_class()(template, output, image_dir)
+        t.render(data)
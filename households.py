@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import itertools
+
+from model import Family
+
+class Households:
+    """Persons grouped into households (union-find over spouse and child relationships).
+
+    The ID of a household is the smallest person ID in it, so it stays the same
+    between runs as long as the household doesn't change.
+    """
+
+    def __init__(self, person_ids=()):
+        self._parent = {person_id: person_id for person_id in person_ids}
+        self.children = set() # IDs of the persons who are in the household of their parents
+
+    def find(self, person_id):
+        """ID of the household of the person."""
+        parent = self._parent.setdefault(person_id, person_id)
+        while parent != person_id:
+            # Path halving
+            self._parent[person_id] = self._parent[parent]
+            person_id = self._parent[person_id]
+            parent = self._parent[person_id]
+        return person_id
+
+    def union(self, person_id, other_id):
+        """Put both persons (and their households) into one household."""
+        household_id, other_household_id = self.find(person_id), self.find(other_id)
+        if household_id == other_household_id:
+            return
+        if other_household_id < household_id:
+            household_id, other_household_id = other_household_id, household_id
+        self._parent[other_household_id] = household_id
+
+    def add_spouse(self, person_id, spouse_id):
+        self.union(person_id, spouse_id)
+
+    def add_child(self, parent_id, child_id):
+        self.union(parent_id, child_id)
+        self.children.add(child_id)
+
+    def families(self, persons):
+        """The persons as Family objects, sorted by the name of the family.
+
+        In a family, the parents come first (husband first), then the children by age.
+        Sets family_id (= household ID) and familyEnd (last person of the family) of the persons.
+        """
+        by_household = {}
+        for person in persons:
+            by_household.setdefault(self.find(person.id), []).append(person)
+
+        families = []
+        for household_id, members in by_household.items():
+            parents = sorted((p for p in members if p.id not in self.children), key=lambda p: (p.sexId or 0, p.id))
+            children = sorted((p for p in members if p.id in self.children),
+                              key=lambda p: (p.birthday_date or datetime.date.max, p.id))
+            # Name of the family (like "Lastname-Husband-Wife") for sorting
+            head = (parents or children)[0]
+            name = '-'.join([head.lastName or ''] + [p.firstName or '' for p in parents or children])
+            families.append((name, household_id, Family(household_id, parents + children)))
+        families.sort(key=lambda family: family[:2])
+
+        for _, _, family in families:
+            for person in family.persons:
+                person.family_id = family.id
+                person.familyEnd = False
+            family.persons[-1].familyEnd = True
+        return [family for _, _, family in families]
+
+def iter_families(persons):
+    """Families of the persons returned by churchtoolsapi.get_persons() (already sorted by family)."""
+    for family_id, persons in itertools.groupby(persons, key=lambda p: p.family_id):
+        yield Family(family_id, list(persons))
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Local mock of the ChurchTools API with synthetic data, to run (and benchmark) the scripts
+# without a ChurchTools instance. Start it and point the scripts to it, e.g.:
+#
+#   ./mockchurchtools.py --persons 5000 --latency 0.05 &
+#   CHURCHTOOLS_DOMAIN=http://127.0.0.1:8765 CHURCHTOOLS_LOGIN_TOKEN=x ./create-memberlist.py --filter-group 1
+
+import argparse
+import collections
+import datetime
+import functools
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Groups and roles of the synthetic data
+MEMBERS_GROUP_ID = 1
+REGULAR_VISITORS_GROUP_ID = 2
+VISITORS_GROUP_ID = 3
+MEMBER_ROLE_ID = 15
+REGULAR_VISITOR_ROLE_ID = 16
+VISITOR_ROLE_ID = 17
+
+# Same limit as ChurchTools
+MAX_PAGE_SIZE = 500
+
+LAST_NAMES = ['Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner', 'Becker', 'Schulz',
+              'Hoffmann', 'Schäfer', 'Koch', 'Bauer', 'Richter', 'Klein', 'Wolf', 'Schröder', 'Neumann',
+              'Schwarz', 'Zimmermann', 'Braun', 'Krüger', 'Hofmann', 'Hartmann', 'Lange', 'Schmitt',
+              'Werner', 'Schmitz', 'Krause', 'Meier', 'Lehmann', 'Schmid', 'Schulze', 'Maier', 'Köhler']
+MALE_NAMES = ['Andreas', 'Daniel', 'David', 'Felix', 'Jan', 'Jonas', 'Lukas', 'Markus', 'Matthias',
+              'Michael', 'Paul', 'Peter', 'Samuel', 'Simon', 'Stefan', 'Thomas', 'Tobias']
+FEMALE_NAMES = ['Anna', 'Christina', 'Elisabeth', 'Hannah', 'Julia', 'Katharina', 'Laura', 'Lea',
+                'Maria', 'Miriam', 'Ruth', 'Sarah', 'Sophie', 'Susanne', 'Lydia', 'Esther']
+CITIES = [('10115', 'Berlin'), ('20095', 'Hamburg'), ('50667', 'Köln'), ('60311', 'Frankfurt'),
+          ('70173', 'Stuttgart'), ('80331', 'München'), ('90402', 'Nürnberg'), ('04109', 'Leipzig')]
+
+class MockData:
+    """Synthetic persons in households, with relationships, group memberships and meetings.
+
+    The same num_persons and seed always give the same data.
+    """
+
+    def __init__(self, num_persons, seed=0):
+        self.seed = seed
+        self.persons = []
+        self.relationships = collections.defaultdict(list) # person ID -> relationships
+        self.group_members = collections.defaultdict(list) # group ID -> (person ID, role ID)
+        rnd = random.Random(seed)
+        while len(self.persons) < num_persons:
+            self._add_household(rnd, num_persons - len(self.persons))
+        self.persons_by_id = {person['id']: person for person in self.persons}
+
+    def _add_person(self, rnd, last_name, sex_id, birth_year, address):
+        person_id = len(self.persons) + 1
+        street, zip_code, city = address
+        person = dict(
+            id=person_id,
+            guid=str(random.Random(person_id).getrandbits(128)),
+            firstName=rnd.choice(MALE_NAMES if sex_id == 1 else FEMALE_NAMES),
+            lastName=last_name,
+            nickname='',
+            sexId=sex_id,
+            birthday=None if rnd.random() < 0.05 else '{}-{:02d}-{:02d}'.format(
+                birth_year, rnd.randint(1, 12), rnd.randint(1, 28)),
+            email='person{}@example.org'.format(person_id),
+            mobile='0170 {:07d}'.format(person_id),
+            phonePrivate='' if rnd.random() < 0.3 else '030 {:06d}'.format(person_id),
+            phoneWork='',
+            street=street,
+            addressAddition='',
+            zip=zip_code,
+            city=city,
+            country='DE',
+            imageUrl=None if rnd.random() < 0.3 else 'images/{}.jpg'.format(person_id),
+            statusId=rnd.choice([1, 2, 3]),
+            campusId=0,
+            familyStatusId=0,
+            meta=dict(createdDate='2020-01-01T00:00:00Z', modifiedDate='2023-{:02d}-{:02d}T12:00:00Z'.format(
+                rnd.randint(1, 12), rnd.randint(1, 28))),
+        )
+        self.persons.append(person)
+        return person
+
+    def _relate(self, person, relative, type_id, degree):
+        self.relationships[person['id']].append(dict(
+            relationshipTypeId=type_id,
+            degreeOfRelationship=degree,
+            relative=dict(domainType='person', domainIdentifier=str(relative['id']),
+                          apiUrl='persons/{}'.format(relative['id']),
+                          domainAttributes=dict(firstName=relative['firstName'], lastName=relative['lastName'])),
+        ))
+
+    def _add_household(self, rnd, max_size):
+        last_name = rnd.choice(LAST_NAMES)
+        address = ('{}straße {}'.format(rnd.choice(LAST_NAMES), rnd.randint(1, 150)),) + rnd.choice(CITIES)
+        kind = rnd.random()
+        parents = []
+        if kind < 0.3 or max_size < 2: # Single
+            parents.append(self._add_person(rnd, last_name, rnd.choice([1, 2]), rnd.randint(1940, 2003), address))
+        else: # Couple or single parent
+            parents.append(self._add_person(rnd, last_name, 1, rnd.randint(1945, 1998), address))
+            if kind < 0.9:
+                parents.append(self._add_person(rnd, last_name, 2, rnd.randint(1945, 1998), address))
+                self._relate(parents[0], parents[1], 2, 'relationship.part.spouse')
+                self._relate(parents[1], parents[0], 2, 'relationship.part.spouse')
+        children = []
+        if kind >= 0.55:
+            for _ in range(min(rnd.randint(1, 4), max_size - len(parents))):
+                children.append(self._add_person(rnd, last_name, rnd.choice([1, 2]), rnd.randint(2000, 2022), address))
+        for parent in parents:
+            for child in children:
+                self._relate(parent, child, 1, 'relationship.part.child')
+                self._relate(child, parent, 1, 'relationship.part.parent')
+
+        group = rnd.random()
+        if group < 0.6:
+            group_id, role_id = MEMBERS_GROUP_ID, MEMBER_ROLE_ID
+        elif group < 0.8:
+            group_id, role_id = REGULAR_VISITORS_GROUP_ID, REGULAR_VISITOR_ROLE_ID
+        elif group < 0.9:
+            group_id, role_id = VISITORS_GROUP_ID, VISITOR_ROLE_ID
+        else:
+            return
+        for person in parents + children:
+            self.group_members[group_id].append((person['id'], role_id))
+
+    def meetings(self, group_id, start_date, end_date):
+        """Sunday meetings of the group from start_date to end_date (exclusive, like ChurchTools)."""
+        today = datetime.date.today()
+        day = start_date + datetime.timedelta(days=(6 - start_date.weekday()) % 7)
+        meetings = []
+        while day < end_date:
+            meeting_id = group_id * 1000000 + day.toordinal() % 1000000
+            present, absent = self._attendance(group_id, meeting_id)
+            meetings.append(dict(
+                id=meeting_id,
+                groupId=group_id,
+                startDate='{}T09:00:00Z'.format(day.isoformat()),
+                endDate='{}T10:30:00Z'.format(day.isoformat()),
+                isCompleted=day < today,
+                comment='Gast {}'.format(meeting_id % 7) if meeting_id % 3 == 0 else None,
+                numGuests=meeting_id % 5,
+                statistics=dict(present=len(present), absent=len(absent), unsure=0),
+            ))
+            day += datetime.timedelta(weeks=1)
+        return meetings
+
+    def _attendance(self, group_id, meeting_id):
+        present, absent = [], []
+        for person_id, role_id in self.group_members[group_id]:
+            # Some persons are absent a lot, most only now and then
+            absence_rate = 60 if person_id % 11 == 0 else 15
+            if int(hashlib.md5('{}-{}'.format(person_id, meeting_id).encode()).hexdigest(), 16) % 100 < absence_rate:
+                absent.append((person_id, role_id))
+            else:
+                present.append((person_id, role_id))
+        return present, absent
+
+    def meeting_members(self, group_id, meeting_id):
+        present, absent = self._attendance(group_id, meeting_id)
+        return [dict(member=self._group_member(person_id, role_id), status=status)
+                for status, members in (('present', present), ('absent', absent))
+                for person_id, role_id in members]
+
+    def _group_member(self, person_id, role_id):
+        person = self.persons_by_id[person_id]
+        return dict(personId=person_id, groupTypeRoleId=role_id, memberStatus='active',
+                    person=dict(domainType='person', domainIdentifier=str(person_id),
+                                domainAttributes=dict(firstName=person['firstName'], lastName=person['lastName'])))
+
+    def group_members_of(self, group_id):
+        return [self._group_member(person_id, role_id) for person_id, role_id in self.group_members[group_id]]
+
+@functools.lru_cache(maxsize=256)
+def _image(person_id):
+    """A profile photo (JPEG) of the person, some tens of KB like real ones."""
+    from PIL import Image, ImageFilter
+    rnd = random.Random(person_id)
+    img = Image.frombytes('RGB', (300, 300), rnd.randbytes(300 * 300 * 3)).filter(ImageFilter.GaussianBlur(3))
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+def _paginated(items, query):
+    limit = min(int(query.get('limit', ['10'])[0]), MAX_PAGE_SIZE)
+    page = int(query.get('page', ['1'])[0])
+    last_page = max(1, -(-len(items) // limit))
+    return dict(data=items[(page - 1) * limit:page * limit],
+                meta=dict(count=len(items), pagination=dict(total=len(items), limit=limit,
+                                                            current=page, lastPage=last_page)))
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body at once (avoids delayed ACKs on kept-alive connections)
+    wbufsize = 1 << 16
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='application/json', headers=()):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def _send_data(self, data, content_type='application/json'):
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            return 304, self._send(304, headers=[('ETag', etag)])
+        return 200, self._send(200, body, content_type, headers=[('ETag', etag)])
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlparse(self.path)
+        if url.path == '/mock/stats':
+            self._send_data(server.stats())
+            return
+        if url.path == '/mock/reset':
+            server.reset_stats()
+            self._send_data({})
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+        endpoint = re.sub(r'/\d+', '/{id}', url.path)
+        if server.failure_rate and server.random.random() < server.failure_rate:
+            sent = self._send(503, headers=[('Retry-After', '0')])
+            server.count(endpoint, 503, sent)
+            return
+        # Like in ChurchTools, the images can be loaded without login
+        if self.headers.get('Authorization') != 'Login ' + server.token and not url.path.startswith('/images/'):
+            server.count(endpoint, 401, self._send(401))
+            return
+
+        status, data, content_type = self._response(url.path, urllib.parse.parse_qs(url.query))
+        if status == 200:
+            status, sent = self._send_data(data, content_type)
+        else:
+            sent = self._send(status)
+        server.count(endpoint, status, sent)
+
+    def _response(self, path, query):
+        data = self.server.data
+        if path == '/api/persons':
+            persons = data.persons
+            if 'ids[]' in query:
+                persons = [data.persons_by_id[int(i)] for i in query['ids[]'] if int(i) in data.persons_by_id]
+            return 200, _paginated([self._with_urls(person) for person in persons], query), 'application/json'
+        match = re.fullmatch(r'/api/persons/(\d+)', path)
+        if match and int(match.group(1)) in data.persons_by_id:
+            return 200, dict(data=self._with_urls(data.persons_by_id[int(match.group(1))])), 'application/json'
+        match = re.fullmatch(r'/api/persons/(\d+)/relationships', path)
+        if match and int(match.group(1)) in data.persons_by_id:
+            relationships = [dict(r, relative=dict(r['relative'], apiUrl=self._url(r['relative']['apiUrl'])))
+                             for r in data.relationships[int(match.group(1))]]
+            return 200, dict(data=relationships, meta=dict(count=len(relationships))), 'application/json'
+        match = re.fullmatch(r'/api/groups/(\d+)/members', path)
+        if match:
+            return 200, _paginated(data.group_members_of(int(match.group(1))), query), 'application/json'
+        match = re.fullmatch(r'/api/groups/(\d+)/meetings', path)
+        if match:
+            start_date = datetime.date.fromisoformat(query['start_date'][0])
+            end_date = datetime.date.fromisoformat(query['end_date'][0])
+            return 200, _paginated(data.meetings(int(match.group(1)), start_date, end_date), query), 'application/json'
+        match = re.fullmatch(r'/api/groups/(\d+)/meetings/(\d+)/members', path)
+        if match:
+            members = data.meeting_members(int(match.group(1)), int(match.group(2)))
+            return 200, dict(data=members, meta=dict(count=len(members))), 'application/json'
+        match = re.fullmatch(r'/images/(\d+)\.jpg', path)
+        if match:
+            return 200, _image(int(match.group(1))), 'image/jpeg'
+        return 404, None, None
+
+    def _url(self, path):
+        return self.server.url + ('' if path.startswith('images/') else 'api/') + path
+
+    def _with_urls(self, person):
+        if not person['imageUrl']:
+            return person
+        return dict(person, imageUrl=self._url(person['imageUrl']))
+
+class MockServer(ThreadingHTTPServer):
+    """Serves MockData like the ChurchTools API, and counts the requests (GET /mock/stats)."""
+    daemon_threads = True
+
+    def __init__(self, data, port=0, latency=0, failure_rate=0, token='x'):
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.data = data
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.token = token
+        self.random = random.Random(data.seed)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server_address[1])
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = collections.Counter() # endpoint -> number of requests
+            self.statuses = collections.Counter() # status code -> number of requests
+            self.bytes_sent = 0
+
+    def count(self, endpoint, status, sent):
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.statuses[str(status)] += 1
+            self.bytes_sent += sent
+
+    def stats(self):
+        with self._lock:
+            return dict(requests=dict(self.requests), statuses=dict(self.statuses), bytesSent=self.bytes_sent)
+
+def start(data, port=0, latency=0, failure_rate=0, token='x'):
+    """Start a MockServer in a background thread. Stop it with shutdown()."""
+    server = MockServer(data, port, latency, failure_rate, token)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock ChurchTools API with synthetic data")
+    parser.add_argument("--persons", type=int, default=1000, help="Number of persons")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="Delay of each response in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0,
+                        help="Share of requests that fail with 503 (0..1)")
+    parser.add_argument("--token", default='x', help="Login token the scripts have to use")
+    args = parser.parse_args()
+
+    server = MockServer(MockData(args.persons, args.seed), args.port, args.latency, args.failure_rate, args.token)
+    print("Mock ChurchTools API with {} persons on {}".format(args.persons, server.url.rstrip('/')))
+    print("Groups: members {}, regular visitors {} (role {}), visitors {}".format(
+        MEMBERS_GROUP_ID, REGULAR_VISITORS_GROUP_ID, REGULAR_VISITOR_ROLE_ID, VISITORS_GROUP_ID))
+    server.serve_forever()
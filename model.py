@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+
+# Fields of a ChurchTools person which are kept (all others are dropped).
+# To use another field in a custom template, add it here.
+PERSON_API_FIELDS = ('id', 'firstName', 'lastName', 'sexId', 'email', 'mobile', 'phonePrivate',
+                     'street', 'zip', 'city', 'imageUrl')
+
+def str_to_date(birthdate_str):
+    if not birthdate_str:
+        return datetime.date(1900, 1, 1)
+    return datetime.datetime.strptime(birthdate_str, "%Y-%m-%d").date()
+
+def age(birthdate):
+    today = datetime.date.today()
+    age = today.year - birthdate.year - ((today.month, today.day) < (birthdate.month, birthdate.day))
+    return age
+
+def format_date(birthdate_str):
+    if not birthdate_str:
+        return ""
+    birthdate = str_to_date(birthdate_str)
+    return birthdate.strftime("%d.%m.%Y")
+
+class Person:
+    """A person, with the fields used by the templates.
+
+    birthday is formatted for display (dd.mm.yyyy), birthday_date is the date (or None).
+    The profile image is kept as a file path if possible, and only read when used.
+    """
+    __slots__ = PERSON_API_FIELDS + ('birthday', 'birthday_date', 'modified', 'children', 'allChildren',
+                                     'family_id', 'familyEnd', 'birthdayHighlight', '_image')
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self.children = []
+        self.allChildren = ''
+        self.familyEnd = False
+        self.birthdayHighlight = ''
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def from_api(cls, data):
+        """Person from the JSON of the ChurchTools API."""
+        person = cls(**{field: data.get(field) for field in PERSON_API_FIELDS})
+        person.birthday = format_date(data.get('birthday'))
+        person.birthday_date = str_to_date(data['birthday']) if data.get('birthday') else None
+        person.modified = (data.get('meta') or {}).get('modifiedDate')
+        return person
+
+    @property
+    def image(self):
+        """Profile image (PNG bytes)."""
+        if isinstance(self._image, str):
+            with open(self._image, 'rb') as f:
+                return f.read()
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        """Set the image, either as bytes or as path of an image file."""
+        self._image = image
+
+    def __repr__(self):
+        return "Person({} {} {})".format(self.id, self.firstName, self.lastName)
+
+class Family:
+    """Persons living in one household."""
+    __slots__ = ('id', 'persons')
+
+    def __init__(self, id, persons=None):
+        self.id = id
+        self.persons = persons if persons is not None else []
+
+    @property
+    def lastName(self):
+        return self.persons[0].lastName if self.persons else ''
+
+class Child:
+    __slots__ = ('name', 'birthdate', 'age')
+
+    def __init__(self, name, birthdate=None):
+        self.name = name
+        self.birthdate = birthdate or datetime.date(1900, 1, 1)
+        self.age = ' ({})'.format(age(birthdate)) if birthdate else ''
+
+    def __lt__(self, other):
+        return self.birthdate > other.birthdate
+
+    def __str__(self):
+        return self.name + self.age
+
+class Member:
+    """A member of a group in a meeting."""
+    __slots__ = ('personId', 'firstName', 'lastName', 'present')
+
+    def __init__(self, personId=None, firstName='', lastName='', present=False):
+        self.personId = personId
+        self.firstName = firstName
+        self.lastName = lastName
+        self.present = present # Whether the person was present in the meeting
+
+    def __hash__(self):
+        return hash(self.personId)
+
+    def __eq__(self, other):
+        return self.personId == other.personId
+
+    def __lt__(self, other):
+        return self.lastName + self.firstName < other.lastName + other.firstName
+
+    def __str__(self):
+        return "{lastName} {firstName}".format(firstName = self.firstName, lastName = self.lastName)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Samuel Mehrbrodt
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Runs the scripts against the mock ChurchTools API (mockchurchtools.py) and measures them.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import mockchurchtools
+
+SCRIPT_DIR = os.path.realpath(os.path.dirname(__file__))
+STARTUP_SCRIPTS = ['show-birthdays.py', 'create-memberlist.py', 'create-all.py']
+STARTUP_BUDGET = 0.25 # Seconds for --help of each script (which imports all modules the script uses)
+
+def _last_sunday():
+    today = datetime.date.today()
+    return today - datetime.timedelta(days=(today.weekday() + 1) % 7 or 7)
+
+def script_args(script, output_dir):
+    """Command line of each script, for the groups of the mock data."""
+    members = str(mockchurchtools.MEMBERS_GROUP_ID)
+    regular_visitors = str(mockchurchtools.REGULAR_VISITORS_GROUP_ID)
+    regular_visitor_role = str(mockchurchtools.REGULAR_VISITOR_ROLE_ID)
+    visitors = str(mockchurchtools.VISITORS_GROUP_ID)
+    output = lambda name: os.path.join(output_dir, name)
+    return {
+        'memberlist': ['create-memberlist.py', '--filter-group', members, '--output', output('memberlist.odt')],
+        'prayerlist': ['create-prayerlist.py', '--filter-group', members, '--output', output('prayerlist.odt')],
+        'checkinform': ['create-checkinform.py', '--group-members', members,
+                        '--group-regularvisitors', regular_visitors, '--role-id-regularvisitors', regular_visitor_role,
+                        '--group-visitors', visitors, '--output', output('checkinform.odt')],
+        'birthdays': ['show-birthdays.py', '--group-members', members,
+                      '--group-regularvisitors', regular_visitors, '--role-id-regularvisitors', regular_visitor_role],
+        'attendancereport': ['create-attendancereport.py', '--group-members', members,
+                             '--group-regular-visitors', regular_visitors,
+                             '--role-id-regularvisitors', regular_visitor_role,
+                             '--date', _last_sunday().isoformat(),
+                             '--output', output('attendancereport.odt'),
+                             '--txt-output', output('attendancereport.txt')],
+    }[script]
+
+def run_script(server, script, extra_args, output_dir):
+    """Run one script against the server. Returns the measurements."""
+    args = script_args(script, output_dir)
+    profile_out = os.path.join(output_dir, 'profile.json')
+    command = [sys.executable, os.path.join(SCRIPT_DIR, args[0])] + args[1:] + ['--profile-out', profile_out] + extra_args
+    env = dict(os.environ, CHURCHTOOLS_DOMAIN=server.url, CHURCHTOOLS_LOGIN_TOKEN=server.token)
+    server.reset_stats()
+    with tempfile.TemporaryFile() as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=SCRIPT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log)
+        # wait4 gives the resource usage of this process only
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        log.seek(0)
+        output = log.read().decode('utf-8', 'replace')
+
+    result = dict(
+        script=script,
+        exitCode=process.returncode,
+        wallTime=round(wall_time, 3),
+        cpuTime=round(usage.ru_utime + usage.ru_stime, 3),
+        maxRssMB=round(usage.ru_maxrss / 1024, 1), # ru_maxrss is in KB on Linux
+    )
+    result.update(server.stats())
+    if process.returncode:
+        result['error'] = output.strip().splitlines()[-1] if output.strip() else ''
+    else:
+        with open(profile_out) as f:
+            result['profile'] = json.load(f)
+    return result
+
+def startup_time(script, repeat=5):
+    """Fastest of several runs of the script with --help, in seconds."""
+    env = dict(os.environ, CHURCHTOOLS_DOMAIN='http://127.0.0.1', CHURCHTOOLS_LOGIN_TOKEN='x')
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script), '--help'],
+                       cwd=SCRIPT_DIR, env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def _phase_time(run, prefix):
+    phases = run.get('profile', {}).get('phases', {})
+    return sum(phase['seconds'] for name, phase in phases.items() if name.split('/')[0] == prefix)
+
+def _version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, previous):
+    """Print the wall time change of each run compared to a previous results file."""
+    previous_times = {(run['persons'], run['script']): run['wallTime'] for run in previous['runs']}
+    print("\nCompared to {} ({}):".format(previous.get('version'), previous.get('date')))
+    for run in results['runs']:
+        previous_time = previous_times.get((run['persons'], run['script']))
+        if previous_time:
+            print("{:>8} {:<18} {:8.2f}s -> {:8.2f}s ({:+.0%})".format(
+                run['persons'], run['script'], previous_time, run['wallTime'], run['wallTime'] / previous_time - 1))
+
+parser = argparse.ArgumentParser(description="Benchmark the scripts against a mock ChurchTools API")
+parser.add_argument("--persons", default="1000", help="Comma-separated numbers of persons to run with (default: 1000)")
+parser.add_argument("--scripts", default="memberlist,prayerlist,checkinform,birthdays,attendancereport",
+                    help="Comma-separated scripts to run")
+parser.add_argument("--latency", type=float, default=0.02, help="Delay of each API response in seconds")
+parser.add_argument("--failure-rate", type=float, default=0, help="Share of API requests that fail with 503 (0..1)")
+parser.add_argument("--repeat", type=int, default=1, help="Run each script this many times")
+parser.add_argument("--seed", type=int, default=0, help="Seed for the mock data")
+parser.add_argument("--output", default="benchmark.json", help="Where to write the results (JSON)")
+parser.add_argument("--compare", help="Results (JSON) of an earlier run to compare with")
+parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+                    help="Fail if the startup (--help) of a script takes longer, in seconds (default: %(default)s)")
+parser.add_argument("script_args", nargs=argparse.REMAINDER,
+                    help="Additional arguments for the scripts, after --, e.g. -- --cache bench-cache.sqlite")
+args = parser.parse_args()
+extra_args = args.script_args[1:] if args.script_args[:1] == ['--'] else args.script_args
+
+results = dict(
+    version=_version(),
+    date=datetime.datetime.now().isoformat(timespec='seconds'),
+    python=platform.python_version(),
+    platform=platform.platform(),
+    latency=args.latency,
+    failureRate=args.failure_rate,
+    scriptArgs=extra_args,
+    startup={},
+    runs=[],
+)
+over_budget = []
+for script in STARTUP_SCRIPTS:
+    seconds = results['startup'][script] = round(startup_time(script), 3)
+    print("Startup {:<24} {:6.3f}s{}".format(script, seconds, "  OVER BUDGET" if seconds > args.startup_budget else ""))
+    if seconds > args.startup_budget:
+        over_budget.append(script)
+print()
+print("{:>8} {:<18} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10}".format(
+    "persons", "script", "wall [s]", "cpu [s]", "RSS [MB]", "fetch [s]", "render [s]", "requests"))
+with tempfile.TemporaryDirectory() as output_dir:
+    for num_persons in [int(n) for n in args.persons.split(',')]:
+        server = mockchurchtools.start(mockchurchtools.MockData(num_persons, args.seed),
+                                       latency=args.latency, failure_rate=args.failure_rate)
+        try:
+            for script in args.scripts.split(','):
+                for _ in range(args.repeat):
+                    run = dict(persons=num_persons, **run_script(server, script, extra_args, output_dir))
+                    results['runs'].append(run)
+                    print("{:>8} {:<18} {:9.2f} {:9.2f} {:9.1f} {:9.2f} {:10.2f} {:10}{}".format(
+                        num_persons, script, run['wallTime'], run['cpuTime'], run['maxRssMB'],
+                        _phase_time(run, 'get_persons'), _phase_time(run, 'render'), sum(run['requests'].values()),
+                        "  FAILED: " + run['error'] if run['exitCode'] else ""))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+with open(args.output, 'w') as f:
+    json.dump(results, f, indent=2)
+print("Results written to {}".format(args.output))
+
+if args.compare:
+    with open(args.compare) as f:
+        compare(results, json.load(f))
+
+if over_budget:
+    sys.exit("Startup of {} takes longer than {}s".format(", ".join(over_budget), args.startup_budget))
@@ -7,11 +7,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
-import datetime
-
-import dateutil.relativedelta as relativedelta
 
 import churchtoolsapi
+import documents
 
 # Parse arguments
 parser = argparse.ArgumentParser()
@@ -20,25 +18,22 @@ parser.add_argument("--group-regularvisitors", help="Group ID where to find regu
 parser.add_argument("--role-id-regularvisitors", help="Only visitors with this role ID")
 parser.add_argument("--group-visitors", help="Group ID where to find other visitors")
 parser.add_argument("--role-id-visitors", help="Only visitors with this role ID")
+parser.add_argument("--days", type=int, default=7, help="Show the birthdays of this many days up to next Sunday (default: 7)")
+churchtoolsapi.add_arguments(parser)
 args = parser.parse_args()
+churchtoolsapi.configure(args)
+
+# Only names and birthdays are needed, so the relationships aren't fetched
 
 # Members
-members_sorted = churchtoolsapi.get_persons(args.group_members)
+members_sorted = churchtoolsapi.get_persons(args.group_members, include_relationships=False)
 
 # Regular visitors
-regularvisitors_sorted = churchtoolsapi.get_persons(args.group_regularvisitors, args.role_id_regularvisitors)
-
-next_sunday = datetime.date.today()
-if next_sunday.weekday() != 6: # Sunday
-    next_sunday += relativedelta.relativedelta(days=1, weekday=relativedelta.SU)
-next_sunday_date = next_sunday.strftime("%d.%m.%Y")
-
-# Highlight recent birthdays
-for member in members_sorted + regularvisitors_sorted:
-    birthday = member['birthday_date']
-    if birthday and birthday != '1900-01-01 00:00:00':
-        birthday = birthday.replace(year=next_sunday.year)
-        delta = (next_sunday - birthday)
-        if delta.days < 7 and delta.days >= 0:
-            print("{} {} {}".format(member['firstName'], member['lastName'], birthday.strftime("%d.%m.")))
+regularvisitors_sorted = churchtoolsapi.get_persons(args.group_regularvisitors, args.role_id_regularvisitors,
+                                                    include_relationships=False)
+
+# Recent birthdays
+for line in documents.birthday_lines(members_sorted + regularvisitors_sorted, args.days):
+    print(line)
 
+churchtoolsapi.finish_run()